@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# bench_iso9075.py - Compare the iso9075 codec against the original
+# character-by-character implementation.
+#
+# Usage: python bench_iso9075.py [length] [repeat]
+#
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import iso9075
+
+
+# The codec as it was before the table-driven rewrite
+
+def legacyValidateNCNameChar(index, char):
+	ch = ord(char)
+	if (ch == ord('_')                     or
+	   (ch >= ord('A') and ch <= ord('Z')) or
+	   (ch >= ord('a') and ch <= ord('z')) or
+	   (ch >= 0x000C0  and ch <= 0x000D6)  or
+	   (ch >= 0x000D8  and ch <= 0x000F6)  or
+	   (ch >= 0x000F8  and ch <= 0x002FF)  or
+	   (ch >= 0x00370  and ch <= 0x0037D)  or
+	   (ch >= 0x0037F  and ch <= 0x01FFF)  or
+	   (ch >= 0x0200C  and ch <= 0x0200D)  or
+	   (ch >= 0x02070  and ch <= 0x0218F)  or
+	   (ch >= 0x02C00  and ch <= 0x02FEF)  or
+	   (ch >= 0x03001  and ch <= 0x0D7FF)  or
+	   (ch >= 0x0F900  and ch <= 0x0FDCF)  or
+	   (ch >= 0x0FDF0  and ch <= 0x0FFFD)  or
+	   (ch >= 0x10000  and ch <= 0xEFFFF)):
+		return True
+	elif not index == 0:
+		if (ch == ord('-')                     or
+			ch == ord('.')                     or
+			ch == 0xB7                         or
+		   (ch >= ord('0') and ch <= ord('9')) or
+		   (ch >= 0x0300   and ch <= 0x036F)   or
+		   (ch >= 0x203F   and ch <= 0x2040)):
+			return True
+	return False
+
+
+def legacyEncode(input):
+	output = unicode()
+	input = unicode(input)
+
+	for i in range(len(input)):
+		if legacyValidateNCNameChar(i, input[i]) == False:
+			output += "_x%04x_" % ord(input[i])
+		elif re.match("_x[0-9a-fA-F]{4}_", input[i:i+7]):
+			output += "_x%04x_" % ord('_')
+		else:
+			output += input[i]
+
+	return output
+
+
+def legacyDecode(input):
+	output = unicode()
+	input = unicode(input)
+
+	i = 0
+	while i < len(input):
+		if re.match("_x[0-9a-fA-F]{4}_", input[i:i+7]):
+			output += unichr(int(input[i+2:i+6], 16))
+			i += 7
+		else:
+			output += input[i]
+			i += 1
+
+	return output
+
+
+def makeIdentifier(length):
+	words = [u"Parameter", u"Kanal", u"Helligkeit", u"\u00dcberwachung", u"Zeit_x0020_", u"(s)", u"1."]
+	output = []
+	size = 0
+
+	while size < length:
+		word = words[len(output) % len(words)]
+		output.append(word)
+		size += len(word) + 1
+
+	return u" ".join(output)[:length]
+
+
+def bench(name, func, arg, number):
+	seconds = min(timeit.repeat(lambda: func(arg), number=number, repeat=3)) / number
+	print "  %-8s %10.1f us" % (name, seconds * 1e6)
+	return seconds
+
+
+def main():
+	length = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+	number = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+	identifier = makeIdentifier(length)
+	encoded = iso9075.encode(identifier)[0]
+
+	assert encoded == legacyEncode(identifier)
+	assert iso9075.decode(encoded)[0] == legacyDecode(encoded)
+
+	print "encode, %d chars:" % len(identifier)
+	before = bench("legacy", legacyEncode, identifier, number)
+	after = bench("iso9075", lambda s: iso9075.encode(s)[0], identifier, number)
+	print "  speedup  %10.1fx" % (before / after)
+
+	print "decode, %d chars:" % len(encoded)
+	before = bench("legacy", legacyDecode, encoded, number)
+	after = bench("iso9075", lambda s: iso9075.decode(s)[0], encoded, number)
+	print "  speedup  %10.1fx" % (before / after)
+
+
+if __name__ == '__main__':
+	main()
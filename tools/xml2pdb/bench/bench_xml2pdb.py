@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+# bench_xml2pdb.py - Time and memory-profile the xml2pdb generation stages
+#
+# A synthetic device (see synthdev.py) is generated against the stand-in
+# bench/knx_master.xml. Each stage is timed on its own, and its peak memory
+# is measured in a forked child process. Results are stored per commit in
+# bench/results/ so runs can be compared with --compare.
+#
+# --compare-template instead times createProduct with the channels written
+# out and written as one channelTemplate, and checks both give the same
+# product file.
+#
+# Usage: python bench_xml2pdb.py [synthdev options] [--compare COMMIT | --compare-template]
+#
+import argparse
+import datetime
+import gc
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, os.pardir))
+
+import devicesource
+import knxmaster
+import synthdev
+import xml2pdb
+import xmlwriter
+from xmlbackend import ET
+
+resultsDir = os.path.join(benchDir, "results")
+masterPath = os.path.join(benchDir, "knx_master.xml")
+
+
+# Memory measurement
+
+def readStatus(field):
+	"""Return a VmRSS/VmHWM style field of /proc/self/status in KiB, or None."""
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith(field + ":"):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return None
+
+
+def resetPeak():
+	# Linux resets VmHWM to the current RSS when 5 is written to clear_refs
+	try:
+		with open("/proc/self/clear_refs", "w") as f:
+			f.write("5")
+		return True
+	except IOError:
+		return False
+
+
+def maxRSS():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Bytes on macOS, KiB everywhere else
+	return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measureStage(stage, source, conn):
+	setup, run = stage
+	state = setup(source)
+	gc.collect()
+
+	if resetPeak() and readStatus("VmHWM") is not None:
+		before = readStatus("VmRSS")
+		run(state)
+		peak = readStatus("VmHWM")
+	else:
+		before = maxRSS()
+		run(state)
+		peak = maxRSS()
+
+	conn.send(max(0, peak - before))
+	conn.close()
+
+
+def stagePeak(stage, source):
+	parentConn, childConn = multiprocessing.Pipe(False)
+	process = multiprocessing.Process(target=measureStage, args=(stage, source, childConn))
+	process.start()
+	peak = parentConn.recv()
+	process.join()
+	return peak
+
+
+# Stages, each a (setup, run) pair. setup is not timed.
+
+datapointIndex = knxmaster.DatapointIndex(masterPath)
+
+
+def newDevice(source):
+	return xml2pdb.DeviceContext(devicesource.readDevice(ET.fromstring(source)), datapointIndex=datapointIndex)
+
+
+def newProductTree(source):
+	return xml2pdb.createProduct(newDevice(source))
+
+
+def newIndentedProductTree(source):
+	productXML = newProductTree(source)
+	xml2pdb.indent(productXML)
+	return productXML
+
+
+def serialize(rootXML):
+	out = io.BytesIO()
+	writer = xmlwriter.XMLWriter(out)
+	writer.startDocument()
+	writer.writeElement(rootXML)
+	writer.endDocument()
+	return out
+
+
+def writeProduct(device):
+	# writeProduct() writes to a path, the null device keeps disk I/O out of the numbers
+	xml2pdb.writeProduct(device, os.devnull)
+
+
+stages = [
+	("masterIndex", (lambda source: knxmaster.DatapointIndex(masterPath), lambda index: index.load())),
+	("parseSource", (lambda source: source, lambda source: devicesource.readDevice(ET.fromstring(source)))),
+	("createCatalog", (newDevice, xml2pdb.createCatalog)),
+	("createHardware", (newDevice, xml2pdb.createHardware)),
+	("createProduct", (newDevice, xml2pdb.createProduct)),
+	("indent", (newProductTree, xml2pdb.indent)),
+	("ElementTree.write", (newIndentedProductTree, lambda rootXML: ET.ElementTree(rootXML).write(io.BytesIO(), "utf-8", True))),
+	("XMLWriter", (newProductTree, serialize)),
+	("writeProduct", (newDevice, writeProduct)),
+]
+
+
+def timeStage(stage, source, repeat):
+	setup, run = stage
+	best = None
+
+	for i in range(repeat):
+		state = setup(source)
+		gc.collect()
+		startTime = time.time()
+		run(state)
+		seconds = time.time() - startTime
+		best = seconds if best is None else min(best, seconds)
+
+	return best
+
+
+def compareTemplate(config, repeat):
+	"""Time createProduct on the channels written out and as a channelTemplate."""
+	products = []
+
+	print "%-20s %12s %12s" % ("channels", "time [ms]", "source [B]")
+
+	for template in (False, True):
+		source = ET.tostring(synthdev.createDevice(**dict(config, template=template)), "utf-8")
+		seconds = timeStage((newDevice, xml2pdb.createProduct), source, repeat)
+		products.append(serialize(xml2pdb.createProduct(newDevice(source))).getvalue())
+
+		print "%-20s %12.2f %12d" % ("channelTemplate" if template else "written out", seconds * 1000, len(source))
+
+	print "Same product file" if products[0] == products[1] else "The product files differ"
+
+
+# Results
+
+def currentCommit():
+	try:
+		output = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=benchDir, stderr=open(os.devnull, "w"))
+		return output.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+
+def loadResult(reference):
+	path = reference if os.path.exists(reference) else os.path.join(resultsDir, reference + ".json")
+
+	with open(path) as f:
+		return json.load(f)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the xml2pdb generation stages on a synthetic device.")
+	synthdev.addArguments(parser)
+	parser.add_argument("--repeat", type=int, default=5, help="timing runs per stage, the fastest counts (default: 5)")
+	parser.add_argument("--compare", metavar="COMMIT", help="compare with the stored result of COMMIT (or a result file)")
+	parser.add_argument("--no-save", action="store_true", help="do not store the result in bench/results")
+	parser.add_argument("--compare-template", action="store_true", help="only compare createProduct with and without a channelTemplate")
+	args = parser.parse_args()
+
+	config = synthdev.deviceArguments(args)
+
+	if args.compare_template:
+		datapointIndex.load()
+		compareTemplate(config, args.repeat)
+		return
+	source = ET.tostring(synthdev.createDevice(**config), "utf-8")
+
+	# Build the index up front, its one-time rebuild is not what is measured
+	datapointIndex.load()
+
+	result = {
+		"commit": currentCommit(),
+		"date": datetime.datetime.now().isoformat(),
+		"python": platform.python_version(),
+		"config": config,
+		"sourceBytes": len(source),
+		"stages": {},
+	}
+
+	reference = loadResult(args.compare) if args.compare else None
+
+	print "%d bytes of device source, %s" % (len(source), ", ".join("%s=%d" % item for item in sorted(config.items())))
+	print "%-20s %12s %12s%s" % ("stage", "time [ms]", "peak [KiB]", "  vs " + reference["commit"] if reference else "")
+
+	for name, stage in stages:
+		seconds = timeStage(stage, source, args.repeat)
+		peak = stagePeak(stage, source)
+		result["stages"][name] = {"seconds": seconds, "peakKiB": peak}
+
+		line = "%-20s %12.2f %12d" % (name, seconds * 1000, peak)
+
+		if reference and name in reference["stages"] and reference["config"] == config:
+			line += "  %6.2fx" % (seconds / reference["stages"][name]["seconds"])
+
+		print line
+
+	if reference and reference["config"] != config:
+		print "Not compared, %s was run with a different device configuration" % reference["commit"]
+
+	if not args.no_save:
+		if not os.path.isdir(resultsDir):
+			os.makedirs(resultsDir)
+
+		path = os.path.join(resultsDir, result["commit"] + ".json")
+
+		with open(path, "w") as f:
+			json.dump(result, f, indent=2, sort_keys=True)
+
+		print "Stored in " + os.path.relpath(path)
+
+
+if __name__ == '__main__':
+	main()
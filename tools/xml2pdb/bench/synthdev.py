@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# synthdev.py - Generate synthetic xml2pdb device sources of any size
+#
+# Usage: python synthdev.py [options] output.xml
+#
+import argparse
+import xml.etree.ElementTree as ET
+
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+parameterTypes = ["unsignedInt", "signedInt", "float", "text", "enumeration"]
+
+# DatapointSubtypes present in bench/knx_master.xml
+datapointTypes = ["DPST-1-1", "DPST-3-7", "DPST-5-1", "DPST-9-1", "DPST-10-1", "DPST-14-56", "DPST-1-2", "DPST-5-3"]
+
+
+def defaultLanguages(count):
+	languages = ["de-DE", "en-US", "fr-FR", "it-IT", "nl-NL", "es-ES", "sv-SE", "da-DK"]
+	if count > len(languages):
+		languages += ["x-%02d" % i for i in range(count - len(languages))]
+	return languages[:count]
+
+
+def addNames(parentXML, tag, text, languages):
+	for language in languages:
+		nameXML = ET.SubElement(parentXML, tag)
+		nameXML.set(XML_LANG, language)
+		nameXML.text = "%s %s" % (text, language[:2].upper())
+
+
+def addParameter(parentXML, type, name, entries, languages):
+	parameterXML = ET.SubElement(parentXML, "parameter")
+	parameterXML.set("type", type)
+
+	if type == "unsignedInt":
+		parameterXML.set("sizeInBit", "8")
+		parameterXML.set("default", "0")
+	elif type == "signedInt":
+		parameterXML.set("sizeInBit", "16")
+		parameterXML.set("minInclusive", "-100")
+		parameterXML.set("maxInclusive", "100")
+		parameterXML.set("uiHint", "Slider")
+		parameterXML.set("default", "0")
+	elif type == "float":
+		parameterXML.set("sizeInBit", "16")
+		parameterXML.set("default", "0")
+	elif type == "text":
+		parameterXML.set("sizeInBit", "112")
+		parameterXML.set("default", "text")
+	else:
+		parameterXML.set("sizeInBit", "8")
+		parameterXML.set("default", "0")
+
+	addNames(parameterXML, "name", name, languages)
+
+	if type == "enumeration":
+		entriesXML = ET.SubElement(parameterXML, "entries")
+
+		for value in range(entries):
+			entryXML = ET.SubElement(entriesXML, "entry")
+			entryXML.set("value", str(value))
+			addNames(entryXML, "name", "Entry %d" % value, languages)
+
+
+def createDevice(channels=2, parameterBlocks=2, parametersPerType=2, entries=4, separators=1, comObjects=4, languages=2, template=False):
+	"""Return the root element of a synthetic device source.
+
+	Every parameter block holds parametersPerType parameters of each type,
+	followed by its separators. Channels are identical apart from their
+	names, like the repeated channels of real actuators. With template set
+	they are written as a single channelTemplate.
+	"""
+	languages = defaultLanguages(languages)
+
+	deviceXML = ET.Element("device")
+
+	infoXML = ET.SubElement(deviceXML, "info")
+	addNames(infoXML, "name", "Synthetic device", languages)
+	addNames(infoXML, "category", "Synthetic category", languages)
+
+	for tag, value in [("catalogNumber", "1"), ("catalogItemNumber", "1"), ("serialNumber", "00000001"),
+	                   ("versionNumber", "1"), ("orderNumber", "00000001"), ("applicationNumber", "1"),
+	                   ("applicationVersion", "1")]:
+		ET.SubElement(infoXML, tag).text = value
+
+	channelsXML = ET.SubElement(deviceXML, "channels")
+
+	if template:
+		channelsXML = ET.SubElement(channelsXML, "channelTemplate")
+		channelsXML.set("repeat", str(channels))
+		channels = 1
+
+	for channelIdx in range(channels):
+		if template:
+			channelXML = channelsXML
+			addNames(channelXML, "name", "Channel {n}", languages)
+		else:
+			channelXML = ET.SubElement(channelsXML, "channel")
+			addNames(channelXML, "name", "Channel %d" % (channelIdx + 1), languages)
+
+		parameterBlocksXML = ET.SubElement(channelXML, "parameterBlocks")
+
+		for blockIdx in range(parameterBlocks):
+			parameterBlockXML = ET.SubElement(parameterBlocksXML, "parameterBlock")
+			addNames(parameterBlockXML, "name", "Block %d" % (blockIdx + 1), languages)
+			parametersXML = ET.SubElement(parameterBlockXML, "parameters")
+
+			for type in parameterTypes:
+				for parameterIdx in range(parametersPerType):
+					addParameter(parametersXML, type, "%s %d" % (type, parameterIdx + 1), entries, languages)
+
+			for separatorIdx in range(separators):
+				separatorXML = ET.SubElement(parametersXML, "parameterSeparator")
+				addNames(separatorXML, "text", "Separator %d" % (separatorIdx + 1), languages)
+
+	comObjectsXML = ET.SubElement(deviceXML, "comObjects")
+
+	for comObjectIdx in range(comObjects):
+		comObjectXML = ET.SubElement(comObjectsXML, "comObject")
+		addNames(comObjectXML, "name", "Object %d" % (comObjectIdx + 1), languages)
+		addNames(comObjectXML, "function", "Function %d" % (comObjectIdx + 1), languages)
+		ET.SubElement(comObjectXML, "datapointType").text = datapointTypes[comObjectIdx % len(datapointTypes)]
+		ET.SubElement(comObjectXML, "readFlag")
+		ET.SubElement(comObjectXML, "writeFlag")
+
+		if comObjectIdx % 2:
+			ET.SubElement(comObjectXML, "transmitFlag")
+
+	return deviceXML
+
+
+def addArguments(parser):
+	parser.add_argument("--channels", type=int, default=8)
+	parser.add_argument("--blocks", type=int, default=4, help="parameter blocks per channel")
+	parser.add_argument("--parameters", type=int, default=4, help="parameters of each type per block")
+	parser.add_argument("--entries", type=int, default=8, help="entries per enumeration")
+	parser.add_argument("--separators", type=int, default=2, help="separators per block")
+	parser.add_argument("--comobjects", type=int, default=64)
+	parser.add_argument("--languages", type=int, default=2)
+	parser.add_argument("--template", action="store_true", help="write the channels as one channelTemplate")
+
+
+def deviceArguments(args):
+	return {
+		"channels": args.channels,
+		"parameterBlocks": args.blocks,
+		"parametersPerType": args.parameters,
+		"entries": args.entries,
+		"separators": args.separators,
+		"comObjects": args.comobjects,
+		"languages": args.languages,
+		"template": args.template,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Write a synthetic xml2pdb device source.")
+	addArguments(parser)
+	parser.add_argument("output")
+	args = parser.parse_args()
+
+	ET.ElementTree(createDevice(**deviceArguments(args))).write(args.output, "utf-8", True)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,136 @@
+#
+# buildcache.py - Skip regenerating artifacts whose inputs did not change
+#
+# Every output directory holds a manifest that records, per generated file,
+# a hash of the inputs it was generated from and a hash of its contents.
+# A file is only regenerated when its input hash changes or it is missing.
+#
+# In canonical mode every file also gets a .sha1 file next to it, in the
+# format of sha1sum, so signed results can be looked up by content.
+#
+import hashlib
+import json
+import os
+
+manifestName = "xml2pdb.manifest.json"
+manifestVersion = 1
+contentHashSuffix = ".sha1"
+
+
+def hashFile(path):
+	digest = hashlib.sha1()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+def replaceFile(tmpPath, path):
+	"""Move the finished tmpPath over path."""
+	# os.rename() does not replace an existing file on Windows
+	if os.path.exists(path):
+		os.remove(path)
+
+	os.rename(tmpPath, path)
+
+
+def writeContentHash(path, digest):
+	with open(path + contentHashSuffix, "w") as f:
+		f.write("%s  %s\n" % (digest, os.path.basename(path)))
+
+
+class HashingFile(object):
+	"""Binary file object that hashes everything it passes on to out."""
+
+	def __init__(self, out):
+		self.out = out
+		self.digest = hashlib.sha1()
+		self.size = 0
+
+	def write(self, data):
+		self.digest.update(data)
+		self.out.write(data)
+		self.size += len(data)
+
+	def tell(self):
+		return self.size
+
+	def hexdigest(self):
+		return self.digest.hexdigest()
+
+
+def hashSources(modules):
+	"""Hash the source files of modules, so a changed generator invalidates the cache."""
+	digest = hashlib.sha1()
+
+	for module in modules:
+		path = os.path.splitext(module.__file__)[0] + ".py"
+
+		with open(path, 'rb') as f:
+			digest.update(f.read())
+
+	return digest.hexdigest()
+
+
+class InputHash(object):
+	"""Accumulates the inputs of one artifact into a SHA-1.
+
+	Values are hashed by their repr(). Device sources are added as their
+	devicesource model, so reformatting a source file does not cause a
+	rebuild.
+	"""
+
+	def __init__(self):
+		self.digest = hashlib.sha1()
+
+	def addValue(self, value):
+		self.digest.update(repr(value))
+		self.digest.update(b"\0")
+
+	def hexdigest(self):
+		return self.digest.hexdigest()
+
+
+class Manifest(object):
+
+	def __init__(self, outputDir):
+		self.path = os.path.join(outputDir, manifestName)
+		self.outputDir = outputDir
+		self.artifacts = {}
+
+		if os.path.exists(self.path):
+			try:
+				with open(self.path) as f:
+					data = json.load(f)
+			except ValueError:
+				data = {}
+
+			if data.get("version") == manifestVersion:
+				self.artifacts = data.get("artifacts", {})
+
+	def upToDate(self, fileName, inputHash):
+		entry = self.artifacts.get(fileName)
+
+		if entry is None or entry.get("inputs") != inputHash:
+			return False
+
+		return os.path.exists(os.path.join(self.outputDir, fileName))
+
+	def update(self, fileName, inputHash, outputHash=None):
+		if outputHash is None:
+			outputHash = hashFile(os.path.join(self.outputDir, fileName))
+
+		self.artifacts[fileName] = {
+			"inputs": inputHash,
+			"output": outputHash,
+		}
+
+	def save(self):
+		tmpPath = "%s.%d.tmp" % (self.path, os.getpid())
+
+		with open(tmpPath, "w") as f:
+			json.dump({"version": manifestVersion, "artifacts": self.artifacts}, f, indent=2, sort_keys=True)
+
+		replaceFile(tmpPath, self.path)
@@ -0,0 +1,314 @@
+#
+# devicesource.py - Read device source XML into a compact model
+#
+# The source tree is walked once and everything the generators need is
+# copied into namedtuples. Texts keep every translation with its language,
+# so generators never have to search the source tree again.
+#
+# A channelTemplate stands for repeat channels that only differ in their
+# texts. {n} in its texts is replaced by the number of the instance,
+# counting from 1, and {key} by the key attribute of its instance element:
+#
+#   <channelTemplate repeat="8">
+#     <name xml:lang="en-US">Output {n} ({room})</name>
+#     <parameterBlocks>...</parameterBlocks>
+#     <instance room="Kitchen" />
+#     <instance room="Hall" />
+#   </channelTemplate>
+#
+# Instances without an instance element only get {n} replaced. Templates
+# stay unexpanded in the model, expandChannels yields their channels on
+# demand.
+#
+# Parameters and separators that are only shown for some values of a
+# parameter go into when elements inside that parameter:
+#
+#   <parameter type="enumeration" sizeInBit="8" default="0">
+#     ...
+#     <when test="1 2">
+#       <parameter ... />
+#     </when>
+#   </parameter>
+#
+import collections
+import re
+from xmlbackend import ET
+
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# text is that of the first element, translations holds (language, text) of
+# every element in source order. language is None where xml:lang is missing.
+Text = collections.namedtuple("Text", "text translations")
+
+DeviceInfo = collections.namedtuple("DeviceInfo", "name category catalogNumber catalogItemNumber serialNumber versionNumber orderNumber applicationNumber applicationVersion")
+Channel = collections.namedtuple("Channel", "name parameterBlocks")
+ParameterBlock = collections.namedtuple("ParameterBlock", "name entries")
+# entries is None if the parameter has no entries element, conditions holds
+# its When branches
+Parameter = collections.namedtuple("Parameter", "name type sizeInBit default minInclusive maxInclusive uiHint pattern entries conditions")
+# test holds the space separated values of the parameter the entries are shown for
+When = collections.namedtuple("When", "test entries")
+Entry = collections.namedtuple("Entry", "value name")
+ParameterSeparator = collections.namedtuple("ParameterSeparator", "text")
+ComObject = collections.namedtuple("ComObject", "name function datapointType readFlag writeFlag transmitFlag")
+# instances holds the substitutions of each instance as sorted (key, value) pairs
+ChannelTemplate = collections.namedtuple("ChannelTemplate", "channel repeat instances")
+Device = collections.namedtuple("Device", "info channels comObjects")
+
+noText = Text(None, ())
+
+
+def groupChildren(elemXML):
+	"""Return {tag: [child, ...]} of the children of elemXML, in source order."""
+	children = {}
+
+	for childXML in elemXML:
+		group = children.get(childXML.tag)
+
+		if group is None:
+			children[childXML.tag] = [childXML]
+		else:
+			group.append(childXML)
+
+	return children
+
+
+def readText(elemsXML):
+	if not elemsXML:
+		return noText
+
+	return Text(elemsXML[0].text, tuple((elemXML.get(XML_LANG), elemXML.text) for elemXML in elemsXML))
+
+
+def childText(children, tag):
+	return children[tag][0].text
+
+
+def readInfo(infoXML):
+	children = groupChildren(infoXML)
+
+	return DeviceInfo(
+		readText(children.get("name")),
+		readText(children.get("category")),
+		childText(children, "catalogNumber"),
+		childText(children, "catalogItemNumber"),
+		childText(children, "serialNumber"),
+		childText(children, "versionNumber"),
+		childText(children, "orderNumber"),
+		childText(children, "applicationNumber"),
+		childText(children, "applicationVersion"),
+	)
+
+
+def readParameter(parameterXML):
+	children = groupChildren(parameterXML)
+	entriesXML = children.get("entries")
+	entries = None
+
+	if entriesXML:
+		entries = tuple(Entry(entryXML.get("value"), readText(entryXML.findall("name"))) for entryXML in entriesXML[0])
+
+	get = parameterXML.get
+	name = readText(children.get("name"))
+
+	return Parameter(name, get("type"), get("sizeInBit"), get("default"),
+	                 get("minInclusive"), get("maxInclusive"), get("uiHint"), get("pattern"), entries,
+	                 readConditions(children.get("when", ()), name))
+
+
+def readConditions(whensXML, name=noText):
+	"""Return the When branches of whensXML, the conditions of parameter name.
+
+	Branches with identical contents are merged into one that is shown for
+	all of their values, so their parameters exist only once.
+	"""
+	tests = collections.OrderedDict()
+
+	for whenXML in whensXML:
+		test = whenXML.get("test")
+
+		if test is None:
+			raise ValueError("parameter %r: unsupported default branch, every when needs a test" % name.text)
+
+		tests.setdefault(readEntries(whenXML), []).append(test)
+
+	return tuple(When(" ".join(test), entries) for entries, test in tests.iteritems())
+
+
+def readEntries(parentXML):
+	entries = []
+
+	for entryXML in parentXML:
+		if entryXML.tag == "parameter":
+			entries.append(readParameter(entryXML))
+		elif entryXML.tag == "parameterSeparator":
+			entries.append(ParameterSeparator(readText(entryXML.findall("text"))))
+		else:
+			print "Unknown tag: " + entryXML.tag
+
+	return tuple(entries)
+
+
+def readParameterBlock(parameterBlockXML):
+	children = groupChildren(parameterBlockXML)
+
+	return ParameterBlock(readText(children.get("name")), readEntries(children["parameters"][0]))
+
+
+def readChannel(channelXML):
+	children = groupChildren(channelXML)
+	parameterBlocks = tuple(readParameterBlock(parameterBlockXML) for parameterBlockXML in children["parameterBlocks"][0])
+
+	return Channel(readText(children.get("name")), parameterBlocks)
+
+
+def readChannelTemplate(templateXML):
+	instances = tuple(tuple(sorted(instanceXML.items())) for instanceXML in templateXML.findall("instance"))
+	repeat = int(templateXML.get("repeat", len(instances)))
+
+	if repeat < len(instances):
+		raise ValueError("channelTemplate: %d instances for a repeat of %d" % (len(instances), repeat))
+
+	return ChannelTemplate(readChannel(templateXML), repeat, instances)
+
+
+def readChannels(channelsXML):
+	channels = []
+
+	for channelXML in channelsXML:
+		if channelXML.tag == "channel":
+			channels.append(readChannel(channelXML))
+		elif channelXML.tag == "channelTemplate":
+			channels.append(readChannelTemplate(channelXML))
+		else:
+			print "Unknown tag: " + channelXML.tag
+
+	return tuple(channels)
+
+
+_placeholder = re.compile(r"\{(\w+)\}")
+
+
+def hasPlaceholder(text):
+	return any(value and "{" in value for language, value in text.translations)
+
+
+def substituteText(text, substitutions):
+	"""Return text with its placeholders replaced, KeyError names a placeholder without a value."""
+	replace = lambda match: substitutions[match.group(1)]
+	translations = tuple((language, _placeholder.sub(replace, value) if value else value) for language, value in text.translations)
+
+	return Text(translations[0][1], translations)
+
+
+# A template is compiled once into functions of the substitutions that only
+# rebuild what holds a placeholder. Their compile function returns None for
+# parts without placeholders, those are shared by every instance.
+
+def compileText(text):
+	if not hasPlaceholder(text):
+		return None
+
+	return lambda substitutions: substituteText(text, substitutions)
+
+
+def compileParameter(parameter):
+	name = compileText(parameter.name)
+	entries = None
+	conditions = tuple(compileEntries(when.entries) for when in parameter.conditions)
+
+	# Most enumeration entries hold no placeholder
+	if parameter.entries is not None and any(hasPlaceholder(entry.name) for entry in parameter.entries):
+		entryNames = [(entry, compileText(entry.name)) for entry in parameter.entries]
+		entries = lambda substitutions: tuple(entry if entryName is None else Entry(entry.value, entryName(substitutions))
+		                                      for entry, entryName in entryNames)
+
+	if name is None and entries is None and not any(conditions):
+		return None
+
+	def substitute(substitutions):
+		return parameter._replace(
+			name=parameter.name if name is None else name(substitutions),
+			entries=parameter.entries if entries is None else entries(substitutions),
+			conditions=tuple(when if whenEntries is None else When(when.test, whenEntries(substitutions))
+			                 for when, whenEntries in zip(parameter.conditions, conditions)))
+
+	return substitute
+
+
+def compileEntries(entries):
+	compiled = []
+
+	for entry in entries:
+		if isinstance(entry, Parameter):
+			compiled.append(compileParameter(entry))
+		else:
+			text = compileText(entry.text)
+			compiled.append(text and (lambda substitutions, text=text: ParameterSeparator(text(substitutions))))
+
+	if not any(compiled):
+		return None
+
+	return lambda substitutions: tuple(entry if substitute is None else substitute(substitutions)
+	                                   for entry, substitute in zip(entries, compiled))
+
+
+def compileChannel(channel):
+	"""Return substitute(substitutions), the channel with the placeholders in all of its texts replaced."""
+	name = compileText(channel.name)
+	parameterBlocks = [(parameterBlock, compileText(parameterBlock.name), compileEntries(parameterBlock.entries))
+	                   for parameterBlock in channel.parameterBlocks]
+
+	def substitute(substitutions):
+		return Channel(channel.name if name is None else name(substitutions),
+		               tuple(ParameterBlock(parameterBlock.name if blockName is None else blockName(substitutions),
+		                                    parameterBlock.entries if entries is None else entries(substitutions))
+		                     for parameterBlock, blockName, entries in parameterBlocks))
+
+	return substitute
+
+
+def expandChannels(channels):
+	"""Yield every channel of channels, with templates expanded one instance at a time."""
+	for channel in channels:
+		if not isinstance(channel, ChannelTemplate):
+			yield channel
+			continue
+
+		substituteChannel = compileChannel(channel.channel)
+
+		for instanceIdx in range(channel.repeat):
+			substitutions = {"n": str(instanceIdx + 1)}
+
+			if instanceIdx < len(channel.instances):
+				substitutions.update(channel.instances[instanceIdx])
+
+			try:
+				instance = substituteChannel(substitutions)
+			except KeyError as e:
+				raise ValueError("channelTemplate %r, instance %d: no value for {%s}" % (channel.channel.name.text, instanceIdx + 1, e.args[0]))
+
+			yield instance
+
+
+def readComObject(comObjectXML):
+	children = groupChildren(comObjectXML)
+
+	return ComObject(readText(children.get("name")), readText(children.get("function")),
+	                 childText(children, "datapointType"),
+	                 "readFlag" in children, "writeFlag" in children, "transmitFlag" in children)
+
+
+def readDevice(srcRootXML):
+	"""Return the Device described by the root element of a device source."""
+	children = groupChildren(srcRootXML)
+
+	info = readInfo(children["info"][0])
+	channels = readChannels(children["channels"][0])
+	comObjects = tuple(readComObject(comObjectXML) for comObjectXML in children["comObjects"][0] if comObjectXML.tag == "comObject")
+
+	return Device(info, channels, comObjects)
+
+
+def loadDevice(srcPath):
+	return readDevice(ET.parse(srcPath).getroot())
@@ -0,0 +1,154 @@
+#
+# filewatch.py - Wait for files to change
+#
+# On Linux inotify is used through ctypes, everywhere else the watched
+# paths are polled. Files are watched through their directory, as editors
+# often save by writing a new file and renaming it over the old one.
+#
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+
+_eventHeader = struct.Struct("iIII")
+
+
+def statKey(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+
+	return (st.st_mtime, st.st_size)
+
+
+class PollingWatcher(object):
+	"""Detects changes by comparing the mtime and size of the watched files.
+
+	paths are files or directories, for directories every file in them is
+	watched.
+	"""
+
+	name = "polling"
+
+	def __init__(self, paths, interval=0.25):
+		self.paths = paths
+		self.interval = interval
+		self.stats = self.scan()
+
+	def scan(self):
+		stats = {}
+
+		for path in self.paths:
+			if os.path.isdir(path):
+				for name in os.listdir(path):
+					stats[os.path.join(path, name)] = statKey(os.path.join(path, name))
+			else:
+				stats[path] = statKey(path)
+
+		return stats
+
+	def wait(self):
+		"""Block until something changed, return the changed paths."""
+		while True:
+			time.sleep(self.interval)
+			stats = self.scan()
+			changed = [path for path in set(stats) | set(self.stats) if stats.get(path) != self.stats.get(path)]
+			self.stats = stats
+
+			if changed:
+				return sorted(changed)
+
+	def close(self):
+		pass
+
+
+class InotifyWatcher(object):
+	"""Detects changes with the Linux inotify API, see PollingWatcher."""
+
+	name = "inotify"
+	mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+	def __init__(self, paths, settle=0.05):
+		libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+		self.settle = settle
+		self.fd = libc.inotify_init()
+
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+		# Watch descriptor to (directory, {name: path}), or None for a watched directory
+		self.watches = {}
+		directories = {}
+
+		for path in paths:
+			if os.path.isdir(path):
+				directories[path] = None
+			else:
+				directory = os.path.dirname(path) or os.curdir
+				files = directories.setdefault(directory, {})
+
+				if files is not None:
+					files[os.path.basename(path)] = path
+
+		for directory, files in directories.items():
+			wd = libc.inotify_add_watch(self.fd, directory, self.mask)
+
+			if wd < 0:
+				os.close(self.fd)
+				raise OSError(ctypes.get_errno(), "Cannot watch " + directory)
+
+			self.watches[wd] = (directory, files)
+
+	def readEvents(self):
+		data = os.read(self.fd, 65536)
+		offset = 0
+
+		while offset < len(data):
+			wd, mask, cookie, length = _eventHeader.unpack_from(data, offset)
+			offset += _eventHeader.size
+			name = data[offset:offset + length].rstrip(b"\0")
+			offset += length
+
+			directory, files = self.watches[wd]
+
+			if files is None:
+				yield os.path.join(directory, name)
+			elif name in files:
+				yield files[name]
+
+	def wait(self):
+		"""Block until something changed, return the changed paths."""
+		changed = set()
+
+		while not changed:
+			changed.update(self.readEvents())
+
+			# Saving may take several steps, collect the events that follow closely
+			while select.select([self.fd], [], [], self.settle)[0]:
+				changed.update(self.readEvents())
+
+		return sorted(changed)
+
+	def close(self):
+		os.close(self.fd)
+
+
+def createWatcher(paths):
+	"""Return an InotifyWatcher where inotify is available, a PollingWatcher otherwise."""
+	if sys.platform.startswith("linux"):
+		try:
+			return InotifyWatcher(paths)
+		except (OSError, AttributeError):
+			pass
+
+	return PollingWatcher(paths)
@@ -17,39 +17,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import bisect
 import codecs
 import re
+import sys
 
 
 # XML NCName validator
 
+# Sorted, non-overlapping (first, last) code point ranges of NCName chars
+_nameStartRanges = [
+    (ord('A'), ord('Z')),
+    (ord('_'), ord('_')),
+    (ord('a'), ord('z')),
+    (0x000C0, 0x000D6),
+    (0x000D8, 0x000F6),
+    (0x000F8, 0x002FF),
+    (0x00370, 0x0037D),
+    (0x0037F, 0x01FFF),
+    (0x0200C, 0x0200D),
+    (0x02070, 0x0218F),
+    (0x02C00, 0x02FEF),
+    (0x03001, 0x0D7FF),
+    (0x0F900, 0x0FDCF),
+    (0x0FDF0, 0x0FFFD),
+    (0x10000, 0xEFFFF),
+]
+
+_nameRanges = sorted(_nameStartRanges + [
+    (ord('-'), ord('.')),
+    (ord('0'), ord('9')),
+    (0x000B7, 0x000B7),
+    (0x00300, 0x0036F),
+    (0x0203F, 0x02040),
+])
+
+_nameStartFirsts = [r[0] for r in _nameStartRanges]
+_nameFirsts = [r[0] for r in _nameRanges]
+
+
+def _inRanges(ch, firsts, ranges):
+    i = bisect.bisect_right(firsts, ch) - 1
+    return i >= 0 and ch <= ranges[i][1]
+
+
 def validateNCNameChar(index, char):
     ch = ord(char)
-    if (ch == ord('_')                     or
-       (ch >= ord('A') and ch <= ord('Z')) or
-       (ch >= ord('a') and ch <= ord('z')) or
-       (ch >= 0x000C0  and ch <= 0x000D6)  or
-       (ch >= 0x000D8  and ch <= 0x000F6)  or
-       (ch >= 0x000F8  and ch <= 0x002FF)  or
-       (ch >= 0x00370  and ch <= 0x0037D)  or
-       (ch >= 0x0037F  and ch <= 0x01FFF)  or
-       (ch >= 0x0200C  and ch <= 0x0200D)  or
-       (ch >= 0x02070  and ch <= 0x0218F)  or
-       (ch >= 0x02C00  and ch <= 0x02FEF)  or
-       (ch >= 0x03001  and ch <= 0x0D7FF)  or
-       (ch >= 0x0F900  and ch <= 0x0FDCF)  or
-       (ch >= 0x0FDF0  and ch <= 0x0FFFD)  or
-       (ch >= 0x10000  and ch <= 0xEFFFF)):
-        return True
-    elif not index == 0:
-        if (ch == ord('-')                     or
-            ch == ord('.')                     or
-            ch == 0xB7                         or
-           (ch >= ord('0') and ch <= ord('9')) or
-           (ch >= 0x0300   and ch <= 0x036F)   or
-           (ch >= 0x203F   and ch <= 0x2040)):
-            return True
-    return False
+    if index == 0:
+        return _inRanges(ch, _nameStartFirsts, _nameStartRanges)
+    return _inRanges(ch, _nameFirsts, _nameRanges)
+
+
+def _charClass(ranges):
+    # A narrow build never sees code points above sys.maxunicode, so ranges
+    # beyond it are left out (they would not compile anyway)
+    items = []
+    for first, last in ranges:
+        if first > sys.maxunicode:
+            continue
+        last = min(last, sys.maxunicode)
+        if first == last:
+            items.append(re.escape(unichr(first)))
+        else:
+            items.append(re.escape(unichr(first)) + u'-' + re.escape(unichr(last)))
+    return u''.join(items)
+
+
+# An underscore that would otherwise be read back as the start of an escape
+_escapeLookalike = u'_(?=x[0-9a-fA-F]{4}_)'
+
+_escapeRE = re.compile(u'_x([0-9a-fA-F]{4})_')
+# The start of an escape that is cut off at the end of the input
+_partialEscapeRE = re.compile(u'_(?:x[0-9a-fA-F]{0,4})?\\Z')
+_lookalikeRE = re.compile(_escapeLookalike)
+_encodeHeadRE = re.compile(
+    u'[^%s]|%s' % (_charClass(_nameStartRanges), _escapeLookalike),
+    re.UNICODE)
+_encodeTailRE = re.compile(
+    u'[^%s]|%s' % (_charClass(_nameRanges), _escapeLookalike),
+    re.UNICODE)
+
+
+def _escapeChar(match):
+    return u'_x%04x_' % ord(match.group())
+
+
+def _unescapeChar(match):
+    return unichr(int(match.group(1), 16))
+
+
+def _partialEscapeStart(input, start=0):
+    """Return where an escape input may end in the middle of begins, or
+    len(input) if more input cannot change how input is converted."""
+    for i in range(max(start, len(input) - 6), len(input)):
+        if input[i] == u'_' and _partialEscapeRE.match(input, i):
+            return i
+    return len(input)
 
 
 # Codec API
@@ -63,26 +126,56 @@ class Codec(codecs.Codec):
         return decode(input, errors)
 
 
-class IncrementalEncoder(codecs.IncrementalEncoder):
+class IncrementalEncoder(codecs.BufferedIncrementalEncoder):
+    """Encodes one name given in chunks.
+
+    An underscore near the end of a chunk is held back until it is known
+    whether it starts an escape lookalike.
+    """
 
     def __init__(self, errors='strict', validate=validateNCNameChar):
+        codecs.BufferedIncrementalEncoder.__init__(self, errors)
+        self.buffer = u''
         self.lastIndex = 0
         self.validate = validate
-        super(IncrementalEncoder, self).__init__(errors)
 
-    def encode(self, input, final=False):
-        def validate(index, char):
-            self.validate(self.lastIndex + index, char)
-    
-        output = encode(input, self.errors, validate)
-        self.lastIndex += output[1]
-        return output[0]
+    def _buffer_encode(self, input, errors, final):
+        end = len(input) if final else _partialEscapeStart(input)
+        output = _encode(input, self.validate, self.lastIndex, end)
+        self.lastIndex += end
+        return (output, end)
+
+    def reset(self):
+        codecs.BufferedIncrementalEncoder.reset(self)
+        self.buffer = u''
+        self.lastIndex = 0
+
+
+class IncrementalDecoder(codecs.BufferedIncrementalDecoder):
+    """Decodes text given in chunks, escapes may be split between them."""
 
+    def __init__(self, errors='strict'):
+        codecs.BufferedIncrementalDecoder.__init__(self, errors)
+        self.buffer = u''
 
-class IncrementalDecoder(codecs.IncrementalDecoder):
+    def _buffer_decode(self, input, errors, final):
+        input = unicode(input)
+        output = []
+        append = output.append
+        last = 0
 
-    def decode(self, input, final=False):
-        return decode(input, self.errors)[0]
+        for match in _escapeRE.finditer(input):
+            append(input[last:match.start()])
+            append(_unescapeChar(match))
+            last = match.end()
+
+        end = len(input) if final else _partialEscapeStart(input, last)
+        append(input[last:end])
+        return (u''.join(output), end)
+
+    def reset(self):
+        codecs.BufferedIncrementalDecoder.reset(self)
+        self.buffer = u''
 
 
 class StreamWriter(Codec, codecs.StreamWriter):
@@ -96,34 +189,52 @@ class StreamReader(Codec, codecs.StreamReader):
 # Encoding & decoding functions
 
 def encode(input, errors = 'strict', validate=validateNCNameChar):
-    output = unicode()
     input = unicode(input)
+    return (_encode(input, validate, 0, len(input)), len(input))
+
 
-    for i in range(len(input)):
-        if validate(i, input[i]) == False:
-            output += "_x%04x_" % ord(input[i])
-        elif re.match("_x[0-9a-fA-F]{4}_", input[i:i+7]):
-            output += "_x%04x_" % ord('_')
+def _encode(input, validate, index, end):
+    """Encode input[:end], the part of a name that starts at index.
+
+    The characters from end on are only looked at to find lookalikes.
+    """
+    if validate is validateNCNameChar:
+        output = []
+        append = output.append
+        last = 0
+
+        if index == 0 and end:
+            head = _encodeHeadRE.match(input)
+            append(_escapeChar(head) if head else input[0])
+            last = 1
+
+        for match in _encodeTailRE.finditer(input, last):
+            if match.start() >= end:
+                break
+            append(input[last:match.start()])
+            append(_escapeChar(match))
+            last = match.end()
+
+        append(input[last:end])
+        return u''.join(output)
+
+    lookalikes = set(m.start() for m in _lookalikeRE.finditer(input))
+    output = []
+    append = output.append
+
+    for i in range(end):
+        char = input[i]
+        if validate(index + i, char) == False or i in lookalikes:
+            append(u'_x%04x_' % ord(char))
         else:
-            output += input[i]
+            append(char)
 
-    return (output, len(input))
+    return u''.join(output)
 
 
 def decode(input, errors = 'strict'):
-    output = unicode()
     input = unicode(input)
-
-    i = 0
-    while i < len(input):
-        if re.match("_x[0-9a-fA-F]{4}_", input[i:i+7]):
-            output += unichr(int(input[i+2:i+6], 16))
-            i += 7
-        else:
-            output += input[i]
-            i += 1
-
-    return (output, len(input))
+    return (_escapeRE.sub(_unescapeChar, input), len(input))
 
 
 # Register the codec search function
@@ -155,12 +266,42 @@ def register(encoding, validate):
 register('iso9075', validateNCNameChar)
 
 
+def convertLines(inFile, outFile, decode=False, chunkSize=65536):
+    """Encode or decode every line of the UTF-8 file inFile to outFile.
+
+    The input is read in chunks, so lines of any length are converted in
+    constant memory.
+    """
+    reader = codecs.getincrementaldecoder('utf-8')()
+
+    if decode:
+        coder = IncrementalDecoder()
+        convertPart = coder.decode
+        convertLine = lambda line: _escapeRE.sub(_unescapeChar, line)
+    else:
+        coder = IncrementalEncoder()
+        convertPart = coder.encode
+        convertLine = lambda line: _encode(line, validateNCNameChar, 0, len(line))
+
+    while True:
+        data = inFile.read(chunkSize)
+        lines = reader.decode(data, not data).split(u'\n')
+
+        if len(lines) > 1:
+            # Only the first line may have begun in an earlier chunk, only
+            # the last may go on in the next one
+            output = [convertPart(lines[0], True)]
+            coder.reset()
+            output.extend(convertLine(line) for line in lines[1:-1])
+            output.append(u'')
+            outFile.write(u'\n'.join(output).encode('utf-8'))
+
+        outFile.write(convertPart(lines[-1], not data).encode('utf-8'))
+
+        if not data:
+            break
+
+
+# Usage: python iso9075.py [-d] < names.txt > converted.txt
 if __name__ == '__main__':
-    
-    import sys
-    for line in sys.stdin.readlines():
-    	if line[-1] == '\n':
-            print unicode(line[:-1], 'utf-8').encode('iso9075').encode('utf-8')
-        else:
-            sys.stdout.write(
-                unicode(line, 'utf-8').encode('iso9075').encode('utf-8'))
+    convertLines(sys.stdin, sys.stdout, decode='-d' in sys.argv[1:])
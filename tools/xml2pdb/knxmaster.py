@@ -0,0 +1,238 @@
+#
+# knxmaster.py - Datapoint lookups against knx_master.xml
+#
+# Parsing the master file takes a long time, so the few attributes the
+# generator needs are kept in a small sqlite index next to it. The index
+# stores the SHA-1 of the master it was built from and is rebuilt whenever
+# the master changes. The master is only hashed again when its size or
+# mtime differ from the ones stored with the index. Nothing is read until
+# the first lookup.
+#
+import collections
+import os
+import sqlite3
+import threading
+from buildcache import hashFile, replaceFile
+from xmlbackend import ET, lxml
+
+knxns = {'knx': 'http://knx.org/xml/project/11'}
+
+indexVersion = 3
+
+DatapointType = collections.namedtuple("DatapointType", "id name sizeInBit")
+DatapointSubtype = collections.namedtuple("DatapointSubtype", "id name typeId")
+
+
+if lxml is not None:
+	_findDatapointSubtypes = lxml.XPath("knx:DatapointSubtypes/knx:DatapointSubtype", namespaces=knxns)
+
+
+def readDatapointsLxml(masterPath):
+	typesTag = "{%s}DatapointTypes" % knxns['knx']
+	typeTag = "{%s}DatapointType" % knxns['knx']
+
+	# Only the end of every DatapointType is reported, it is dropped with
+	# everything before it once its records are read
+	for event, typeXML in lxml.iterparse(masterPath, events=("end",), tag=(typeTag, typesTag), remove_comments=True):
+		if typeXML.tag == typesTag:
+			break
+
+		typeId = typeXML.get("Id")
+		yield DatapointType(typeId, typeXML.get("Name"), int(typeXML.get("SizeInBit")))
+
+		for subtypeXML in _findDatapointSubtypes(typeXML):
+			yield DatapointSubtype(subtypeXML.get("Id"), subtypeXML.get("Name"), typeId)
+
+		typeXML.clear()
+
+		while typeXML.getprevious() is not None:
+			del typeXML.getparent()[0]
+
+
+def readDatapoints(masterPath):
+	"""Stream the DatapointTypes section of masterPath.
+
+	Yields DatapointType records, each followed by its DatapointSubtype
+	records. Every element is dropped from the tree as soon as it ends and
+	parsing stops at the end of the DatapointTypes section.
+	"""
+	if lxml is not None:
+		for record in readDatapointsLxml(masterPath):
+			yield record
+		return
+
+	typesTag = "{%s}DatapointTypes" % knxns['knx']
+	typeTag = "{%s}DatapointType" % knxns['knx']
+	subtypeTag = "{%s}DatapointSubtype" % knxns['knx']
+
+	parents = []
+	typeId = None
+
+	for event, elem in ET.iterparse(masterPath, events=("start", "end")):
+		if event == "start":
+			if elem.tag == typeTag:
+				typeId = elem.get("Id")
+				yield DatapointType(typeId, elem.get("Name"), int(elem.get("SizeInBit")))
+			elif elem.tag == subtypeTag:
+				yield DatapointSubtype(elem.get("Id"), elem.get("Name"), typeId)
+
+			parents.append(elem)
+			continue
+
+		parents.pop()
+		elem.clear()
+
+		# At its end event an element is always the last child of its parent
+		if parents:
+			del parents[-1][-1]
+
+		if elem.tag == typesTag:
+			break
+
+
+def masterStat(masterPath):
+	"""Return the size and mtime of masterPath as stored in the index."""
+	st = os.stat(masterPath)
+	return (str(st.st_size), repr(st.st_mtime))
+
+
+def buildIndex(masterPath, indexPath):
+	"""Read the datapoints of masterPath and store them in indexPath.
+
+	Returns (types, subtypes) as readIndex() does. If the index cannot be
+	written, e.g. next to a read-only master, they are only kept in memory.
+	"""
+	# Taken before reading, a master changed meanwhile is seen as stale next time
+	size, mtime = masterStat(masterPath)
+	masterHash = hashFile(masterPath)
+	types = {}
+	subtypes = {}
+
+	for record in readDatapoints(masterPath):
+		if isinstance(record, DatapointType):
+			types[record.id] = record
+		else:
+			subtypes[record.id] = record
+
+	tmpPath = "%s.%d.tmp" % (indexPath, os.getpid())
+
+	try:
+		if os.path.exists(tmpPath):
+			os.remove(tmpPath)
+
+		db = sqlite3.connect(tmpPath)
+		try:
+			db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+			db.execute("CREATE TABLE datapointType (id TEXT PRIMARY KEY, name TEXT, sizeInBit INTEGER)")
+			db.execute("CREATE TABLE datapointSubtype (id TEXT PRIMARY KEY, name TEXT, typeId TEXT)")
+			db.executemany("INSERT INTO meta VALUES (?, ?)", [("version", str(indexVersion)), ("masterHash", masterHash),
+			                                                     ("masterSize", size), ("masterMtime", mtime)])
+			db.executemany("INSERT INTO datapointType VALUES (?, ?, ?)", types.itervalues())
+			db.executemany("INSERT INTO datapointSubtype VALUES (?, ?, ?)", subtypes.itervalues())
+			db.commit()
+		finally:
+			db.close()
+
+		replaceFile(tmpPath, indexPath)
+	except (sqlite3.Error, OSError, IOError):
+		if os.path.exists(tmpPath):
+			try:
+				os.remove(tmpPath)
+			except OSError:
+				pass
+
+	return (types, subtypes)
+
+
+def readIndex(indexPath, masterPath):
+	"""Return (types, subtypes) stored in indexPath, or None if it is stale."""
+	if not os.path.exists(indexPath):
+		return None
+
+	db = sqlite3.connect(indexPath)
+	try:
+		meta = dict(db.execute("SELECT key, value FROM meta"))
+
+		if meta.get("version") != str(indexVersion):
+			return None
+
+		size, mtime = masterStat(masterPath)
+
+		if (meta.get("masterSize"), meta.get("masterMtime")) != (size, mtime):
+			if meta.get("masterHash") != hashFile(masterPath):
+				return None
+
+			# Same contents with a new mtime, e.g. after a checkout
+			try:
+				db.executemany("UPDATE meta SET value = ? WHERE key = ?", [(size, "masterSize"), (mtime, "masterMtime")])
+				db.commit()
+			except sqlite3.Error:
+				pass
+
+		types = {}
+		subtypes = {}
+
+		for row in db.execute("SELECT id, name, sizeInBit FROM datapointType"):
+			types[row[0]] = DatapointType(*row)
+
+		for row in db.execute("SELECT id, name, typeId FROM datapointSubtype"):
+			subtypes[row[0]] = DatapointSubtype(*row)
+
+		return (types, subtypes)
+	except sqlite3.DatabaseError:
+		return None
+	finally:
+		db.close()
+
+
+class DatapointIndex(object):
+	"""Maps DatapointSubtype ids to (DatapointType id, SizeInBit).
+
+	The index is only loaded (or rebuilt) when the first lookup is made.
+	"""
+
+	def __init__(self, masterPath='knx_master.xml', indexPath=None):
+		if indexPath is None:
+			indexPath = os.path.splitext(masterPath)[0] + ".idx"
+
+		self.masterPath = masterPath
+		self.indexPath = indexPath
+		self._types = None
+		self._subtypes = None
+		self._lock = threading.Lock()
+
+	def load(self):
+		if self._subtypes is not None:
+			return
+
+		with self._lock:
+			if self._subtypes is not None:
+				return
+
+			datapoints = readIndex(self.indexPath, self.masterPath)
+
+			if datapoints is None:
+				datapoints = buildIndex(self.masterPath, self.indexPath)
+
+			self._types, self._subtypes = datapoints
+
+	@property
+	def types(self):
+		self.load()
+		return self._types
+
+	@property
+	def subtypes(self):
+		self.load()
+		return self._subtypes
+
+	def lookup(self, subtypeId):
+		try:
+			subtype = self.subtypes[subtypeId]
+		except KeyError:
+			raise KeyError("Unknown DatapointSubtype: " + subtypeId)
+
+		return (subtype.typeId, self.types[subtype.typeId].sizeInBit)
+
+	def __contains__(self, subtypeId):
+		return subtypeId in self.subtypes
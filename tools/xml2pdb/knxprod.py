@@ -0,0 +1,148 @@
+#
+# knxprod.py - Write .knxprod archives without temporary files
+#
+# A .knxprod file is a zip archive holding the generated files in a folder
+# named after the manufacturer id, e.g. M-013A/Catalog.xml. Every file is
+# serialized straight into a DeflateSink, which compresses it on a thread of
+# its own, so one file is compressed while the next one is being serialized.
+# zipfile in Python 2 can neither stream into an entry nor take deflated
+# data, hence the archive itself is written here as well.
+#
+import Queue
+import struct
+import threading
+import time
+import zlib
+
+_localHeader = struct.Struct("<4s2B4HL2L2H")
+_centralHeader = struct.Struct("<4s4B4HL2L5H2L")
+_endRecord = struct.Struct("<4s4H2LH")
+
+
+class DeflateSink(object):
+	"""Binary file object that deflates everything written to it in memory."""
+
+	def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION):
+		self.level = level
+		self.size = 0
+		self.crc = 0
+		self.data = None
+		self.error = None
+		# Bounded, so a fast writer cannot pile up uncompressed data
+		self.queue = Queue.Queue(64)
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def write(self, data):
+		self.size += len(data)
+		self.queue.put(data)
+
+	def tell(self):
+		return self.size
+
+	def run(self):
+		try:
+			compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+			chunks = []
+			crc = 0
+
+			for data in iter(self.queue.get, None):
+				crc = zlib.crc32(data, crc)
+				chunks.append(compressor.compress(data))
+
+			chunks.append(compressor.flush())
+			self.crc = crc & 0xffffffff
+			self.data = b"".join(chunks)
+		except Exception as e:
+			self.error = e
+			# Keep draining, the writer must never block on a full queue
+			for data in iter(self.queue.get, None):
+				pass
+
+	def close(self):
+		"""Wait for the compression to finish and return the deflated data."""
+		if self.thread.is_alive():
+			self.queue.put(None)
+			self.thread.join()
+
+		if self.error is not None:
+			raise self.error
+
+		return self.data
+
+
+def dosDateTime(dateTime):
+	year, month, day, hour, minute, second = dateTime[:6]
+	return ((year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2)
+
+
+class PackageWriter(object):
+	"""Writes a zip archive of deflated entries to a binary file object."""
+
+	def __init__(self, out, dateTime=None):
+		self.out = out
+		self.offset = 0
+		self.entries = []
+		self.date, self.time = dosDateTime(dateTime or time.localtime())
+
+	def add(self, name, sink):
+		data = sink.close()
+		name = name.encode("utf-8")
+
+		if sink.size > 0xffffffff or self.offset > 0xffffffff:
+			raise ValueError("%s: archives beyond 4 GiB need ZIP64, which is not supported" % name)
+
+		self.out.write(_localHeader.pack(b"PK\x03\x04", 20, 0, 0, zlib.DEFLATED, self.time, self.date,
+		                                 sink.crc, len(data), sink.size, len(name), 0))
+		self.out.write(name)
+		self.out.write(data)
+
+		self.entries.append((name, sink.crc, len(data), sink.size, self.offset))
+		self.offset += _localHeader.size + len(name) + len(data)
+
+	def close(self):
+		centralOffset = self.offset
+
+		for name, crc, compressedSize, size, offset in self.entries:
+			self.out.write(_centralHeader.pack(b"PK\x01\x02", 20, 0, 20, 0, 0, zlib.DEFLATED, self.time, self.date,
+			                                   crc, compressedSize, size, len(name), 0, 0, 0, 0, 0, offset))
+			self.out.write(name)
+			self.offset += _centralHeader.size + len(name)
+
+		self.out.write(_endRecord.pack(b"PK\x05\x06", 0, 0, len(self.entries), len(self.entries),
+		                               self.offset - centralOffset, centralOffset, 0))
+
+
+def serializePackage(out, folder, files, dateTime=None):
+	"""Write a .knxprod archive to the binary file object out.
+
+	files are (file name, serialize) pairs, serialize(out) writes the file
+	to a binary file object. They are stored as folder/file name, in order,
+	dated dateTime or, by default, now.
+	"""
+	sinks = []
+
+	# The archive is only assembled once every file has been serialized,
+	# compression of the earlier files overlaps serialization of the later ones
+	try:
+		for fileName, serialize in files:
+			sink = DeflateSink()
+			sinks.append((folder + "/" + fileName, sink))
+			serialize(sink)
+	except Exception:
+		for name, sink in sinks:
+			sink.queue.put(None)
+		raise
+
+	package = PackageWriter(out, dateTime)
+
+	for name, sink in sinks:
+		package.add(name, sink)
+
+	package.close()
+
+
+def writePackage(path, folder, files, dateTime=None):
+	with open(path, "wb") as f:
+		serializePackage(f, folder, files, dateTime)
@@ -0,0 +1,76 @@
+#
+# memorylayout.py - Place tables and parameters in device memory
+#
+# Segments are laid out one after the other from a start address. Among
+# the parameters, those of a byte or more are placed in source order,
+# smaller ones are packed into as few bytes as possible behind them.
+# A parameter never crosses a byte boundary unless it is a byte or larger.
+#
+import collections
+
+Segment = collections.namedtuple("Segment", "address size")
+Placement = collections.namedtuple("Placement", "offset bitOffset")
+
+
+def addressTableSize(maxEntries):
+	# Entry count, the individual address and a group address per entry
+	return 1 + 2 + 2 * maxEntries
+
+
+def associationTableSize(maxEntries):
+	# Entry count and an address index/object number pair per entry
+	return 1 + 2 * maxEntries
+
+
+def packParameters(sizes):
+	"""Return (placements, size in bytes) for parameters of sizes in bits.
+
+	Sub-byte parameters are packed best fit decreasing: each goes into the
+	fullest byte it still fits in. Equal sizes keep their source order.
+	"""
+	placements = [None] * len(sizes)
+	offset = 0
+	small = []
+
+	for i, sizeInBit in enumerate(sizes):
+		if sizeInBit >= 8:
+			placements[i] = Placement(offset, 0)
+			offset += (sizeInBit + 7) // 8
+		else:
+			small.append(i)
+
+	# Indices of the packed bytes that have 0 to 7 bits left, and the bits used in each
+	partial = [collections.deque() for bits in range(8)]
+	used = []
+
+	for i in sorted(small, key=lambda i: -sizes[i]):
+		sizeInBit = sizes[i]
+
+		for freeBits in range(sizeInBit, 8):
+			if partial[freeBits]:
+				byteIdx = partial[freeBits].popleft()
+				break
+		else:
+			byteIdx = len(used)
+			used.append(0)
+			freeBits = 8
+
+		placements[i] = Placement(offset + byteIdx, used[byteIdx])
+		used[byteIdx] += sizeInBit
+
+		if freeBits > sizeInBit:
+			partial[freeBits - sizeInBit].append(byteIdx)
+
+	return (placements, offset + len(used))
+
+
+class SegmentAllocator(object):
+	"""Hands out consecutive segments starting at address."""
+
+	def __init__(self, address):
+		self.address = address
+
+	def allocate(self, size):
+		segment = Segment(self.address, size)
+		self.address += size
+		return segment
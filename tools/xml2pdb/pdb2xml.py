@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+#
+# pdb2xml.py - Convert existing KNX product files back to a device source
+#
+# Usage: python pdb2xml.py [-c Catalog.xml] [-H Hardware.xml] application.xml device.xml
+#
+# Vendor application programs can be hundreds of megabytes, so every file is
+# read in a single iterparse pass. All attributes that matter are read at
+# the start event, and every element is dropped from the tree at its end
+# event. Only small indexes of the parameter types, parameters and refs and
+# the com objects stay in memory, together with the source being built.
+# Static precedes Dynamic, so parameters are resolved while Dynamic is read.
+# Languages come last, so texts are filled in once the pass is done.
+#
+import argparse
+import collections
+import sys
+import xmlwriter
+from xmlbackend import ET
+
+# attributes are those of the source parameter element, enumerations holds
+# (value, enumeration id, text) or is None
+ParameterType = collections.namedtuple("ParameterType", "attributes enumerations")
+Parameter = collections.namedtuple("Parameter", "id parameterTypeId text value")
+ParameterRef = collections.namedtuple("ParameterRef", "id parameterId text value")
+
+floatSizes = {"DPT 9": "16", "IEEE-754 Single": "32", "IEEE-754 Double": "64"}
+
+
+def localName(tag):
+	return tag[tag.find("}") + 1:]
+
+
+class SourceImporter(object):
+	"""Builds a device source from an application program and, optionally,
+	the Catalog and Hardware files of the same product."""
+
+	def __init__(self):
+		self.info = {}
+		self.defaultLanguage = "de-DE"
+		self.parameterTypes = {}
+		self.parameters = {}
+		self.parameterRefs = {}
+		# Com object id to its datapointType element
+		self.datapointTypesXML = {}
+
+		# Placeholder element to (element id, attribute, text), the texts are
+		# only written out by write(), once the translations are known
+		self.texts = {}
+		self.textIds = set()
+		# Element id to {attribute: [(language, text)]}, only for ids in textIds
+		self.translations = {}
+
+		self.deviceXML = ET.Element("device")
+		self.infoXML = ET.SubElement(self.deviceXML, "info")
+		self.channelsXML = ET.SubElement(self.deviceXML, "channels")
+		self.comObjectsXML = ET.SubElement(self.deviceXML, "comObjects")
+
+		# (parameter blocks, entries, choose) to return to at the end of a Dynamic container
+		self.dynamicStack = []
+		self.parameterBlocksXML = None
+		self.entriesXML = None
+		# The parameter the branches of the current choose go into
+		self.chooseXML = None
+		self.parametersByRef = {}
+		self.independentChannelXML = None
+
+		self.applicationProgramId = None
+		self.applicationProgramName = None
+		self.parameterTypeId = None
+		self.parameterType = None
+		self.language = None
+		self.elementId = None
+
+		self.startHandlers = {
+			"ApplicationProgram": self.startApplicationProgram,
+			"ParameterType": self.startParameterType,
+			"TypeNumber": self.startTypeNumber,
+			"TypeFloat": self.startTypeFloat,
+			"TypeText": self.startTypeText,
+			"TypeRestriction": self.startTypeRestriction,
+			"Enumeration": self.startEnumeration,
+			"Parameter": self.startParameter,
+			"ParameterRef": self.startParameterRef,
+			"ComObject": self.startComObject,
+			"ComObjectRef": self.startComObjectRef,
+			"Channel": self.startChannel,
+			"ChannelIndependentBlock": self.startChannelIndependentBlock,
+			"ParameterBlock": self.startParameterBlock,
+			"ParameterRefRef": self.startParameterRefRef,
+			"ParameterSeparator": self.startParameterSeparator,
+			"choose": self.startChoose,
+			"when": self.startWhen,
+			"CatalogSection": self.startCatalogSection,
+			"CatalogItem": self.startCatalogItem,
+			"Hardware": self.startHardware,
+			"Product": self.startProduct,
+			"Language": self.startLanguage,
+			"TranslationElement": self.startTranslationElement,
+			"Translation": self.startTranslation,
+		}
+
+		self.endHandlers = {
+			"ParameterType": self.endParameterType,
+			"Channel": self.endDynamicContainer,
+			"ChannelIndependentBlock": self.endDynamicContainer,
+			"ParameterBlock": self.endDynamicContainer,
+			"choose": self.endDynamicContainer,
+			"when": self.endDynamicContainer,
+		}
+
+	def read(self, path):
+		"""Read one product file, every element is dropped as soon as it ends."""
+		parents = []
+		# Namespaced tag to tag, the KNX namespace differs between schema versions
+		localNames = {}
+
+		for event, elem in ET.iterparse(path, events=("start", "end")):
+			tag = localNames.get(elem.tag)
+
+			if tag is None:
+				tag = localNames[elem.tag] = localName(elem.tag)
+
+			if event == "start":
+				handler = self.startHandlers.get(tag)
+
+				if handler is not None:
+					handler(elem)
+
+				parents.append(elem)
+				continue
+
+			parents.pop()
+
+			handler = self.endHandlers.get(tag)
+
+			if handler is not None:
+				handler(elem)
+
+			elem.clear()
+
+			# At its end event an element is always the last child of its parent
+			if parents:
+				del parents[-1][-1]
+
+	def addText(self, parentXML, tag, elementId, attribute, text):
+		"""Add the tag elements of the text with its translations to parentXML."""
+		self.texts[ET.SubElement(parentXML, tag)] = (elementId, attribute, text)
+		self.textIds.add(elementId)
+
+	def setInfo(self, key, value):
+		if key not in self.info:
+			self.info[key] = value
+
+	# ApplicationProgram, Static
+
+	def startApplicationProgram(self, elem):
+		self.applicationProgramId = elem.get("Id")
+		self.applicationProgramName = elem.get("Name")
+		self.defaultLanguage = elem.get("DefaultLanguage", self.defaultLanguage)
+		self.setInfo("applicationNumber", elem.get("ApplicationNumber"))
+		self.setInfo("applicationVersion", elem.get("ApplicationVersion"))
+		self.addText(self.infoXML, "name", elem.get("Id"), "Name", elem.get("Name"))
+
+	def startParameterType(self, elem):
+		self.parameterTypeId = elem.get("Id")
+		self.parameterType = ParameterType(None, None)
+
+	def startTypeNumber(self, elem):
+		attributes = {"type": elem.get("Type"), "sizeInBit": elem.get("SizeInBit")}
+		self.parameterType = ParameterType(self.rangeAttributes(elem, attributes), None)
+
+	def startTypeFloat(self, elem):
+		encoding = elem.get("Encoding")
+
+		if encoding not in floatSizes:
+			print "Unknown float encoding: %s" % encoding
+			return
+
+		attributes = {"type": "float", "sizeInBit": floatSizes[encoding]}
+		self.parameterType = ParameterType(self.rangeAttributes(elem, attributes), None)
+
+	def rangeAttributes(self, elem, attributes):
+		for key, attribute in [("minInclusive", "minInclusive"), ("maxInclusive", "maxInclusive"), ("uiHint", "UIHint")]:
+			if elem.get(attribute) is not None:
+				attributes[key] = elem.get(attribute)
+
+		return attributes
+
+	def startTypeText(self, elem):
+		attributes = {"type": "text", "sizeInBit": elem.get("SizeInBit")}
+
+		if elem.get("Pattern") is not None:
+			attributes["pattern"] = elem.get("Pattern")
+
+		self.parameterType = ParameterType(attributes, None)
+
+	def startTypeRestriction(self, elem):
+		self.parameterType = ParameterType({"type": "enumeration", "sizeInBit": elem.get("SizeInBit")}, [])
+
+	def startEnumeration(self, elem):
+		if self.parameterType.enumerations is not None:
+			self.parameterType.enumerations.append((elem.get("Value"), elem.get("Id"), elem.get("Text")))
+
+	def endParameterType(self, elem):
+		if self.parameterType.attributes is None:
+			print "Unsupported parameter type: %s" % self.parameterTypeId
+
+		self.parameterTypes[self.parameterTypeId] = self.parameterType
+		self.parameterType = None
+
+	def startParameter(self, elem):
+		self.parameters[elem.get("Id")] = Parameter(elem.get("Id"), elem.get("ParameterType"), elem.get("Text"), elem.get("Value"))
+
+	def startParameterRef(self, elem):
+		self.parameterRefs[elem.get("Id")] = ParameterRef(elem.get("Id"), elem.get("RefId"), elem.get("Text"), elem.get("Value"))
+
+	def startComObject(self, elem):
+		comObjectXML = ET.SubElement(self.comObjectsXML, "comObject")
+		self.addText(comObjectXML, "name", elem.get("Id"), "Text", elem.get("Text"))
+		self.addText(comObjectXML, "function", elem.get("Id"), "FunctionText", elem.get("FunctionText"))
+
+		# The first of several datapoint types is the one the source can hold
+		datapointTypeXML = ET.SubElement(comObjectXML, "datapointType")
+		datapointTypeXML.text = (elem.get("DatapointType") or "").split(" ")[0]
+		self.datapointTypesXML[elem.get("Id")] = datapointTypeXML
+
+		for attribute, tag in [("ReadFlag", "readFlag"), ("WriteFlag", "writeFlag"), ("TransmitFlag", "transmitFlag")]:
+			if elem.get(attribute) == "Enabled":
+				ET.SubElement(comObjectXML, tag)
+
+	def startComObjectRef(self, elem):
+		# Only used for com objects that do not name a datapoint type themselves
+		datapointTypeXML = self.datapointTypesXML.get(elem.get("RefId"))
+
+		if datapointTypeXML is not None and not datapointTypeXML.text and elem.get("DatapointType"):
+			datapointTypeXML.text = elem.get("DatapointType").split(" ")[0]
+
+	# Dynamic
+
+	def pushDynamic(self):
+		self.dynamicStack.append((self.parameterBlocksXML, self.entriesXML, self.chooseXML))
+
+	def endDynamicContainer(self, elem):
+		self.parameterBlocksXML, self.entriesXML, self.chooseXML = self.dynamicStack.pop()
+
+	def startChannel(self, elem):
+		self.pushDynamic()
+		channelXML = ET.SubElement(self.channelsXML, "channel")
+		self.addText(channelXML, "name", elem.get("Id"), "Text", elem.get("Text"))
+		self.parameterBlocksXML = ET.SubElement(channelXML, "parameterBlocks")
+		self.entriesXML = None
+
+	def startChannelIndependentBlock(self, elem):
+		self.pushDynamic()
+		self.parameterBlocksXML = None
+		self.entriesXML = None
+
+	def startParameterBlock(self, elem):
+		self.pushDynamic()
+
+		# Parameter blocks outside of channels go into one channel named after the program
+		if self.parameterBlocksXML is None:
+			if self.independentChannelXML is None:
+				self.independentChannelXML = ET.SubElement(self.channelsXML, "channel")
+				self.addText(self.independentChannelXML, "name", self.applicationProgramId, "Name", self.applicationProgramName)
+				ET.SubElement(self.independentChannelXML, "parameterBlocks")
+
+			self.parameterBlocksXML = self.independentChannelXML.find("parameterBlocks")
+
+		parameterBlockXML = ET.SubElement(self.parameterBlocksXML, "parameterBlock")
+		self.addText(parameterBlockXML, "name", elem.get("Id"), "Text", elem.get("Text") or elem.get("Name"))
+		self.entriesXML = ET.SubElement(parameterBlockXML, "parameters")
+
+	def startParameterRefRef(self, elem):
+		if self.entriesXML is None:
+			print "Parameter outside of a parameter block: %s" % elem.get("RefId")
+			return
+
+		parameterRef = self.parameterRefs[elem.get("RefId")]
+		parameter = self.parameters[parameterRef.parameterId]
+		parameterType = self.parameterTypes[parameter.parameterTypeId]
+
+		if parameterType.attributes is None:
+			return
+
+		parameterXML = ET.SubElement(self.entriesXML, "parameter", dict(parameterType.attributes))
+		parameterXML.set("default", parameterRef.value if parameterRef.value is not None else parameter.value or "")
+
+		if parameterRef.text is not None:
+			self.addText(parameterXML, "name", parameterRef.id, "Text", parameterRef.text)
+		else:
+			self.addText(parameterXML, "name", parameter.id, "Text", parameter.text)
+
+		if parameterType.enumerations is not None:
+			entriesXML = ET.SubElement(parameterXML, "entries")
+
+			for value, enumerationId, text in parameterType.enumerations:
+				entryXML = ET.SubElement(entriesXML, "entry")
+				entryXML.set("value", value)
+				self.addText(entryXML, "name", enumerationId, "Text", text)
+
+		self.parametersByRef[parameterRef.id] = parameterXML
+
+	def startParameterSeparator(self, elem):
+		if self.entriesXML is None:
+			return
+
+		separatorXML = ET.SubElement(self.entriesXML, "parameterSeparator")
+
+		if elem.get("Text"):
+			self.addText(separatorXML, "text", elem.get("Id"), "Text", elem.get("Text"))
+
+	def startChoose(self, elem):
+		self.pushDynamic()
+		parameterXML = self.parametersByRef.get(elem.get("ParamRefId"))
+
+		# The source can only hold branches inside the parameter they depend on
+		if parameterXML is None or self.entriesXML is None:
+			print "Unsupported choose, its branches are shown unconditionally: %s" % elem.get("ParamRefId")
+			self.chooseXML = None
+		else:
+			self.chooseXML = parameterXML
+
+	def startWhen(self, elem):
+		self.pushDynamic()
+
+		if self.chooseXML is not None:
+			if elem.get("test") is None:
+				print "Unsupported default branch, it is shown unconditionally: %s" % self.chooseXML.findtext("name")
+			else:
+				self.entriesXML = ET.SubElement(self.chooseXML, "when")
+				self.entriesXML.set("test", elem.get("test"))
+
+	# Catalog and Hardware
+
+	def startCatalogSection(self, elem):
+		if "catalogNumber" not in self.info:
+			self.setInfo("catalogNumber", elem.get("Number"))
+			self.addText(self.infoXML, "category", elem.get("Id"), "Name", elem.get("Name"))
+
+	def startCatalogItem(self, elem):
+		self.setInfo("catalogItemNumber", elem.get("Number"))
+
+	def startHardware(self, elem):
+		# The Hardware element inside Manufacturer is a list, only the inner one has an Id
+		if elem.get("Id") is not None:
+			self.setInfo("serialNumber", elem.get("SerialNumber"))
+			self.setInfo("versionNumber", elem.get("VersionNumber"))
+
+	def startProduct(self, elem):
+		self.setInfo("orderNumber", elem.get("OrderNumber"))
+
+	# Languages
+
+	def startLanguage(self, elem):
+		self.language = elem.get("Identifier")
+
+	def startTranslationElement(self, elem):
+		self.elementId = elem.get("RefId")
+
+	def startTranslation(self, elem):
+		if self.elementId in self.textIds:
+			attributes = self.translations.setdefault(self.elementId, {})
+			attributes.setdefault(elem.get("AttributeName"), []).append((self.language, elem.get("Text")))
+
+	def translate(self, elementId, attribute, text):
+		"""Return (language, text) of every translation of an attribute."""
+		translations = self.translations.get(elementId, {}).get(attribute, [])
+
+		# The attribute itself is the text of the default language
+		return [(self.defaultLanguage, text)] + [(language, translation) for language, translation in translations if language != self.defaultLanguage]
+
+	def write(self, out):
+		"""Write the device source to the binary file object out."""
+		for key in ["catalogNumber", "catalogItemNumber", "serialNumber", "versionNumber", "orderNumber", "applicationNumber", "applicationVersion"]:
+			if self.info.get(key) is None:
+				print "Missing %s, using 0" % key
+
+			ET.SubElement(self.infoXML, key).text = self.info.get(key) or "0"
+
+		writer = xmlwriter.XMLWriter(out, indent="\t")
+		writer.startDocument()
+		writer.startElement(self.deviceXML.tag, self.deviceXML.attrib)
+
+		# Like XMLWriter.writeElement(), but the text elements are only
+		# created one at a time, in place of their placeholders
+		children = [iter(self.deviceXML)]
+
+		while children:
+			child = next(children[-1], None)
+
+			if child is None:
+				children.pop()
+				writer.endElement()
+				continue
+
+			text = self.texts.get(child)
+
+			if text is not None:
+				for language, translation in self.translate(*text):
+					textXML = ET.Element(child.tag)
+					textXML.set("xml:lang", language)
+					textXML.text = translation
+					writer.writeElement(textXML)
+				continue
+
+			writer.startElement(child.tag, child.attrib)
+
+			if len(child):
+				children.append(iter(child))
+			else:
+				writer.writeLeaf(child)
+
+		writer.endDocument()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Convert a KNX application program back to an xml2pdb device source.")
+	parser.add_argument("program", help="application program XML, e.g. M-013A_A-0004-02-F00D.xml")
+	parser.add_argument("output", help="device source XML to write")
+	parser.add_argument("-c", "--catalog", help="Catalog.xml of the product")
+	parser.add_argument("-H", "--hardware", help="Hardware.xml of the product")
+	args = parser.parse_args(argv)
+
+	importer = SourceImporter()
+
+	for path in [args.program, args.catalog, args.hardware]:
+		if path is not None:
+			importer.read(path)
+
+	with open(args.output, "wb") as f:
+		importer.write(f)
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,123 @@
+#
+# profiling.py - Stage timers and counters for xml2pdb runs
+#
+# A Profiler is attached to a DeviceContext. Generators time their stages
+# with profiler.stage() and count work with profiler.count(). Hot functions
+# are only wrapped by wrap() when profiling is enabled, the default
+# NullProfiler returns them unchanged, so a disabled profiler costs next to
+# nothing.
+#
+import collections
+import time
+
+
+class _NullStage(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *excInfo):
+		return False
+
+
+class NullProfiler(object):
+	"""Profiler that records nothing."""
+
+	enabled = False
+	_stage = _NullStage()
+
+	def stage(self, name):
+		return self._stage
+
+	def count(self, name, n=1):
+		pass
+
+	def wrap(self, name, func):
+		return func
+
+
+nullProfiler = NullProfiler()
+
+
+class _Stage(object):
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.startTime = time.time()
+		return self
+
+	def __exit__(self, *excInfo):
+		self.profiler.record(self.name, time.time() - self.startTime)
+		return False
+
+
+class Profiler(object):
+	"""Collects the time spent per stage and counters of a generation run.
+
+	Every hook is called as hook(name, seconds) whenever a stage or an
+	wrapped call ends, which lets embedding code forward the numbers
+	to its own metrics.
+	"""
+
+	enabled = True
+
+	def __init__(self, hooks=()):
+		self.stages = collections.OrderedDict()
+		self.counters = collections.OrderedDict()
+		self.hooks = list(hooks)
+
+	def stage(self, name):
+		return _Stage(self, name)
+
+	def record(self, name, seconds):
+		entry = self.stages.get(name)
+
+		if entry is None:
+			entry = self.stages[name] = [0, 0.0]
+
+		entry[0] += 1
+		entry[1] += seconds
+
+		for hook in self.hooks:
+			hook(name, seconds)
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def wrap(self, name, func):
+		"""Return func timing and counting every call as the stage name."""
+		record = self.record
+		clock = time.time
+
+		def timed(*args, **kwargs):
+			startTime = clock()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				record(name, clock() - startTime)
+
+		return timed
+
+	def merge(self, report):
+		"""Add a report() of another profiler, e.g. from a worker process."""
+		for name, entry in report["stages"].items():
+			own = self.stages.get(name)
+
+			if own is None:
+				own = self.stages[name] = [0, 0.0]
+
+			own[0] += entry["calls"]
+			own[1] += entry["seconds"]
+
+		for name, n in report["counters"].items():
+			self.count(name, n)
+
+	def report(self):
+		return {
+			"stages": collections.OrderedDict(
+				(name, collections.OrderedDict([("calls", calls), ("seconds", seconds)])) for name, (calls, seconds) in self.stages.items()),
+			"counters": collections.OrderedDict(self.counters),
+		}
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# service.py - Generate devices on request from a long running local process
+#
+# Starting xml2pdb for every device spends most of its time loading the
+# datapoint index of knx_master.xml. The service loads it once, forks a pool
+# of workers that inherit it, and answers HTTP requests on localhost:
+#
+#   curl --data-binary @testdev.xml http://127.0.0.1:8073/generate
+#   curl --data-binary @testdev.xml "http://127.0.0.1:8073/generate?package=1" > testdev.knxprod
+#
+# The body of a POST to /generate is the device source XML. The answer is a
+# JSON object {file name: contents}, or with package=1 the .knxprod archive.
+# The query may also set compact=1, stream=1, procedure=product and
+# manufacturer=M-xxxx.
+# Recent results are kept in memory, keyed by the source and the options.
+# The master is read at startup, restart the service after changing it.
+#
+import argparse
+import BaseHTTPServer
+import collections
+import hashlib
+import json
+import multiprocessing
+import SocketServer
+import sys
+import threading
+import traceback
+import urlparse
+
+import xml2pdb
+
+
+class ResultCache(object):
+	"""Least recently used results, safe to share between threads."""
+
+	def __init__(self, size=64):
+		self.size = size
+		self.results = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			result = self.results.pop(key, None)
+
+			if result is not None:
+				self.results[key] = result
+
+			return result
+
+	def put(self, key, result):
+		with self.lock:
+			self.results.pop(key, None)
+			self.results[key] = result
+
+			while len(self.results) > self.size:
+				self.results.popitem(last=False)
+
+
+def renderJob(job):
+	"""Run xml2pdb.renderDevice in a worker, returning (result, None) or (None, traceback)."""
+	srcData, options = job
+
+	try:
+		return (xml2pdb.renderDevice(srcData, **options), None)
+	except Exception:
+		return (None, traceback.format_exc())
+
+
+class GenerateServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, pool, cache):
+		BaseHTTPServer.HTTPServer.__init__(self, address, GenerateHandler)
+		self.pool = pool
+		self.cache = cache
+
+
+class GenerateHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	def do_POST(self):
+		url = urlparse.urlparse(self.path)
+
+		if url.path != "/generate":
+			self.send_error(404)
+			return
+
+		query = dict(urlparse.parse_qsl(url.query))
+		options = {
+			"manufacturerId": query.get("manufacturer", "M-013A"),
+			"stream": query.get("stream") == "1",
+			"compact": query.get("compact") == "1",
+			"package": query.get("package") == "1",
+			"productProcedure": query.get("procedure") == "product",
+		}
+
+		srcData = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		key = hashlib.sha1(srcData + json.dumps(options, sort_keys=True)).hexdigest()
+		result = self.server.cache.get(key)
+
+		if result is None:
+			result, error = self.server.pool.apply(renderJob, ((srcData, options),))
+
+			if error is not None:
+				self.reply(400, "text/plain", error)
+				return
+
+			self.server.cache.put(key, result)
+
+		if options["package"]:
+			self.reply(200, "application/zip", result)
+		else:
+			self.reply(200, "application/json", json.dumps(collections.OrderedDict(result)))
+
+	def reply(self, status, contentType, body):
+		self.send_response(status)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Generate KNX product files on request over HTTP on localhost.")
+	parser.add_argument("-m", "--master", default="knx_master.xml", help="path to knx_master.xml")
+	parser.add_argument("-p", "--port", type=int, default=8073, help="port to listen on (default: 8073)")
+	parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="number of devices to generate in parallel (default: number of CPUs)")
+	parser.add_argument("--cache", type=int, default=64, help="number of results kept in memory (default: 64)")
+	args = parser.parse_args(argv)
+
+	# Load before forking, so the workers start with the index in memory
+	xml2pdb.sharedDatapointIndex = xml2pdb.knxmaster.DatapointIndex(args.master)
+	xml2pdb.sharedDatapointIndex.load()
+
+	pool = multiprocessing.Pool(args.jobs, xml2pdb.initWorker, (args.master,))
+	server = GenerateServer(("127.0.0.1", args.port), pool, ResultCache(args.cache))
+	print "Listening on http://127.0.0.1:%d/generate" % args.port
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		pool.terminate()
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
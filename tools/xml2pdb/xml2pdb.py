@@ -1,86 +1,199 @@
-import xml.etree.ElementTree as ET
-import iso9075
-
-masterTree = ET.parse('knx_master.xml')
-masterRoot = masterTree.getroot()
-knxns = {'knx': 'http://knx.org/xml/project/11'}
-
-tree = ET.parse('testdev.xml')
-root = tree.getroot()
-srcDeviceXML = root.find("info")
-
-#manufacturerId = srcDeviceXML.find("manufacturerId").text
-manufacturerId = "M-013A"
-catalogNumber = srcDeviceXML.find("catalogNumber").text
-catalogItemNumber = srcDeviceXML.find("catalogItemNumber").text
-serialNumber = srcDeviceXML.find("serialNumber").text
-versionNumber = srcDeviceXML.find("versionNumber").text
-orderNumber = srcDeviceXML.find("orderNumber").text
-applicationNumber = srcDeviceXML.find("applicationNumber").text
-applicationVersion = srcDeviceXML.find("applicationVersion").text
-
-catalogSectionId = manufacturerId + "_CS-" + catalogNumber
-hardwareId = manufacturerId + "_H-" + serialNumber + "-" + versionNumber
-productId= hardwareId + "_P-" + orderNumber
-hardware2ProgramId = hardwareId + "_HP-" + "%04X" % int(applicationNumber) + "-" + "%02X" % int(applicationVersion) + "-F00D"
-applicationProgramId = manufacturerId + "_A-" + "%04X" % int(applicationNumber) + "-" + "%02X" % int(applicationVersion) + "-F00D"
-catalogItemId = hardware2ProgramId + "_CI-" + orderNumber + "-" + catalogItemNumber
+import argparse
+import collections
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import buildcache
+import devicesource
+import filewatch
+import knxmaster
+import knxprod
+import memorylayout
+import profiling
+import xmlbackend
+import xmlwriter
+from xmlbackend import ET
+
+# Used by every DeviceContext that is not given an index of its own
+sharedDatapointIndex = knxmaster.DatapointIndex('knx_master.xml')
+
+# Memory the application program is loaded into
+codeStartAddress = 0x4000
+tableMaxEntries = 200
+comObjectTableSize = 360
+
+# Load state machines of the MV-0705 mask
+lsmAddressTable = 1
+lsmAssociationTable = 2
+lsmApplication = 3
+
+# Written to the root of every file, fixed so that unchanged sources give unchanged files
+createdBy = "knxconv"
+toolVersion = "4.0.1907.45562"
+
+# Date of every entry of a canonical archive, the earliest a zip archive can hold
+canonicalDateTime = (1980, 1, 1, 0, 0, 0)
+
+MemoryLayout = collections.namedtuple("MemoryLayout", "addressTable associationTable application parametersOffset placements")
+
+# Every module the generated files depend on
+generatorModules = [sys.modules[__name__], devicesource, knxmaster, knxprod, memorylayout, xmlbackend, xmlwriter]
+
+# Part of every artifact's input hash, changing the generator invalidates the build cache
+generatorHash = buildcache.hashSources(generatorModules)
+
+class DeviceContext(object):
+	"""Ids and counters of one device being generated.
+
+	Every generator reads its ids from here instead of module globals, so
+	several devices can be generated in one process or in parallel threads.
+	"""
+
+	def __init__(self, source, manufacturerId="M-013A", datapointIndex=None, profiler=None, productProcedure=False):
+		if datapointIndex is None:
+			datapointIndex = sharedDatapointIndex
+
+		if profiler is None:
+			profiler = profiling.nullProfiler
+
+		info = source.info
+
+		self.source = source
+		self.datapointIndex = datapointIndex
+		self.profiler = profiler
+		# Declare an explicit load procedure instead of the default one of the mask
+		self.productProcedure = productProcedure
+
+		#self.manufacturerId = info.manufacturerId
+		self.manufacturerId = manufacturerId
+		self.catalogNumber = info.catalogNumber
+		self.catalogItemNumber = info.catalogItemNumber
+		self.serialNumber = info.serialNumber
+		self.versionNumber = info.versionNumber
+		self.orderNumber = info.orderNumber
+		self.applicationNumber = info.applicationNumber
+		self.applicationVersion = info.applicationVersion
+
+		self.catalogSectionId = self.manufacturerId + "_CS-" + self.catalogNumber
+		self.hardwareId = self.manufacturerId + "_H-" + self.serialNumber + "-" + self.versionNumber
+		self.productId = self.hardwareId + "_P-" + self.orderNumber
+		self.hardware2ProgramId = self.hardwareId + "_HP-" + "%04X" % int(self.applicationNumber) + "-" + "%02X" % int(self.applicationVersion) + "-F00D"
+		self.applicationProgramId = self.manufacturerId + "_A-" + "%04X" % int(self.applicationNumber) + "-" + "%02X" % int(self.applicationVersion) + "-F00D"
+		self.catalogItemId = self.hardware2ProgramId + "_CI-" + self.orderNumber + "-" + self.catalogItemNumber
+
+		self._channels = None
+		self.resetCounters()
+
+	@property
+	def channels(self):
+		"""The channels of the source, templates expanded on the first walk only."""
+		if self._channels is None:
+			self._channels = tuple(devicesource.expandChannels(self.source.channels))
+
+		return self._channels
+
+	def resetCounters(self):
+		self.channelIdx = -1
+		self.parameterBlockIdx = 0
+		self.parameterIdx = 0
+		self.parameterSeparatorIdx = 0
+
+def loadDevice(srcPath, manufacturerId="M-013A", datapointIndex=None, profiler=None, productProcedure=False):
+	with (profiler or profiling.nullProfiler).stage("parseSource"):
+		source = devicesource.loadDevice(srcPath)
+
+	return DeviceContext(source, manufacturerId, datapointIndex, profiler, productProcedure)
 
 def indent(elem, level=0):
+	# Iterative, deep Dynamic trees must not hit the recursion limit.
+	# Every element sets the tails of its children, only the top one its own.
 	i = "\n" + level*"  "
-	if len(elem):
+	if (len(elem) or level) and (not elem.tail or not elem.tail.strip()):
+		elem.tail = i
+
+	stack = [(elem, level)]
+
+	while stack:
+		elem, level = stack.pop()
+		if not len(elem):
+			continue
+		i = "\n" + level*"  "
 		if not elem.text or not elem.text.strip():
 			elem.text = i + "  "
-		if not elem.tail or not elem.tail.strip():
-			elem.tail = i
-		for elem in elem:
-			indent(elem, level+1)
-		if not elem.tail or not elem.tail.strip():
-			elem.tail = i
-	else:
-		if level and (not elem.tail or not elem.tail.strip()):
-			elem.tail = i
+		for child in elem:
+			if not child.tail or not child.tail.strip():
+				child.tail = i + "  "
+			stack.append((child, level+1))
+		if not child.tail or not child.tail.strip():
+			child.tail = i
 
-def addTranslations(languagesXML, itemsXML, unitId, elementId, tagName):
-	for itemXML in itemsXML:
-		countryCode = itemXML.get("{http://www.w3.org/XML/1998/namespace}lang")
-		
-		if countryCode is None:
-			continue
+class Translations(object):
+	"""Collects translations per language, unit and element.
 
-		translation = itemXML.text
+	The Languages subtree is only built once, by createLanguagesNode(), so
+	adding a translation never has to search the elements added before.
+	Languages, units and elements keep the order they were first seen in.
+	"""
 
-		languageXML = languagesXML.find("*[@Identifier='" + countryCode + "']")
-		
-		if languageXML is None:
+	def __init__(self, profiler=profiling.nullProfiler):
+		self.languages = collections.OrderedDict()
+
+		if profiler.enabled:
+			self.add = profiler.wrap("addTranslations", self.add)
+
+	def add(self, text, unitId, elementId, tagName):
+		for countryCode, translation in text.translations:
+			if countryCode is None:
+				continue
+
+			units = self.languages.get(countryCode)
+
+			if units is None:
+				units = self.languages[countryCode] = collections.OrderedDict()
+
+			elements = units.get(unitId)
+
+			if elements is None:
+				elements = units[unitId] = collections.OrderedDict()
+
+			translations = elements.get(elementId)
+
+			if translations is None:
+				translations = elements[elementId] = []
+
+			translations.append((tagName, translation))
+
+		return
+
+	def createLanguagesNode(self):
+		languagesXML = ET.Element("Languages")
+
+		for countryCode, units in self.languages.iteritems():
 			languageXML = ET.SubElement(languagesXML, "Language")
 			languageXML.set("Identifier", countryCode)
 
-		translationUnitXML = languageXML.find("*[@RefId='" + unitId + "']")
-	
-		if translationUnitXML is None:
-			translationUnitXML = ET.SubElement(languageXML, "TranslationUnit")
-			translationUnitXML.set("RefId", unitId)
-	
-		translationElementXML = translationUnitXML.find("*[@RefId='" + elementId + "']")
+			for unitId, elements in units.iteritems():
+				translationUnitXML = ET.SubElement(languageXML, "TranslationUnit")
+				translationUnitXML.set("RefId", unitId)
 
-		if translationElementXML is None:
-			translationElementXML = ET.SubElement(translationUnitXML, "TranslationElement")
-			translationElementXML.set("RefId", elementId)
-	
-		translationXML = ET.SubElement(translationElementXML, "Translation")
-		translationXML.set("AttributeName", tagName)
-		translationXML.set("Text", translation)
-
-	return
+				for elementId, translations in elements.iteritems():
+					translationElementXML = ET.SubElement(translationUnitXML, "TranslationElement")
+					translationElementXML.set("RefId", elementId)
 
-parameterBlockIdx = 0
+					for tagName, translation in translations:
+						translationXML = ET.SubElement(translationElementXML, "Translation")
+						translationXML.set("AttributeName", tagName)
+						translationXML.set("Text", translation)
 
-def addParameterBlock(parentXML, name):
-	global parameterBlockIdx
+		return languagesXML
 
-	parameterBlockIdx += 1
-	parameterBlockId = applicationProgramId + "_PB-%d" % parameterBlockIdx
+def addParameterBlock(parentXML, parameterBlockId, name):
 	parameterBlockXML = ET.SubElement(parentXML, "ParameterBlock")
 	parameterBlockXML.set("Id", parameterBlockId)
 	parameterBlockXML.set("Name", name)
@@ -90,85 +203,137 @@ def addParameterBlock(parentXML, name):
 
 	return parameterBlockXML
 
-channelIdx = -1
-
-def addChannel(parentXML, name):
-	global channelIdx
-
-	channelIdx += 1
-	channelId = applicationProgramId + "_CH-%d" % channelIdx
+def addChannel(parentXML, channelId, number, name):
 	channelXML = ET.SubElement(parentXML, "Channel")
 	channelXML.set("Id", channelId)
 	channelXML.set("Name", name)
 	channelXML.set("Text", name)
-	channelXML.set("Number", str(channelIdx))
+	channelXML.set("Number", str(number))
 
 	return channelXML
 
+def walkChannels(device):
+	"""Yield (tag, id, entry) for every channel, parameter block, parameter
+	and parameter separator of the device, in source order.
+
+	Numbering restarts on every walk, so the Static and Dynamic sections can
+	be built in separate passes and still agree on ids.
+	"""
+	device.resetCounters()
+	applicationProgramId = device.applicationProgramId
+
+	for channel in device.channels:
+		device.channelIdx += 1
+		yield ("channel", applicationProgramId + "_CH-%d" % device.channelIdx, channel)
+
+		for parameterBlock in channel.parameterBlocks:
+			device.parameterBlockIdx += 1
+			yield ("parameterBlock", applicationProgramId + "_PB-%d" % device.parameterBlockIdx, parameterBlock)
+
+			for item in walkEntries(device, parameterBlock.entries):
+				yield item
+
+def walkEntries(device, entries):
+	"""Yield the parameters and separators of entries for walkChannels.
+
+	The branches of a parameter follow it as ("choose", parameter id,
+	parameter), then ("when", None, when), its entries and ("end", None, when)
+	per branch, and a final ("end", None, parameter).
+	"""
+	applicationProgramId = device.applicationProgramId
+
+	for entry in entries:
+		if isinstance(entry, devicesource.Parameter):
+			device.parameterIdx += 1
+			parameterId = applicationProgramId + "_P-%d" % device.parameterIdx
+			yield ("parameter", parameterId, entry)
+
+			if entry.conditions:
+				yield ("choose", parameterId, entry)
+
+				for when in entry.conditions:
+					yield ("when", None, when)
+
+					for item in walkEntries(device, when.entries):
+						yield item
+
+					yield ("end", None, when)
+
+				yield ("end", None, entry)
+		else:
+			device.parameterSeparatorIdx += 1
+			yield ("parameterSeparator", applicationProgramId + "_PS-%d" % device.parameterSeparatorIdx, entry)
+
+def walkComObjects(device):
+	"""Yield (number, comObjectId, comObjectRefId, comObject) for every comObject."""
+	for comObjectIdx, comObject in enumerate(device.source.comObjects):
+		comObjectId = device.applicationProgramId + "_O-%d" % comObjectIdx
+		yield (comObjectIdx, comObjectId, comObjectId + "_R-%d" % (comObjectIdx + 1), comObject)
+
 def createRootNode():
 	rootXML = ET.Element("KNX")
 
 	rootXML.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
 	rootXML.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
-	rootXML.set("CreatedBy", "knxconv")
-	rootXML.set("ToolVersion", "4.0.1907.45562")
+	rootXML.set("CreatedBy", createdBy)
+	rootXML.set("ToolVersion", toolVersion)
 	rootXML.set("xmlns", "http://knx.org/xml/project/11")
 
 	return rootXML
 
-def createCatalog(srcRootXML):
-	languagesXML = ET.Element("Languages")
-	srcDeviceXML = srcRootXML.find("info")
+def createCatalog(device):
+	translations = Translations(device.profiler)
+	info = device.source.info
 	dstRootXML = createRootNode()
 
 	manufacturerDataXML = ET.SubElement(dstRootXML, "ManufacturerData")
 
 	manufacturerXML = ET.SubElement(manufacturerDataXML, "Manufacturer")
-	manufacturerXML.set("RefId", manufacturerId)
+	manufacturerXML.set("RefId", device.manufacturerId)
 
 	catalogXML = ET.SubElement(manufacturerXML, "Catalog")
 
 	catalogSectionXML = ET.SubElement(catalogXML, "CatalogSection")
-	catalogSectionXML.set("Id", catalogSectionId)
-	catalogSectionXML.set("Name", srcDeviceXML.find("category").text)
-	addTranslations(languagesXML, srcDeviceXML.findall("category"), catalogSectionId, catalogSectionId, "Name")
-	catalogSectionXML.set("Number", catalogNumber)
+	catalogSectionXML.set("Id", device.catalogSectionId)
+	catalogSectionXML.set("Name", info.category.text)
+	translations.add(info.category, device.catalogSectionId, device.catalogSectionId, "Name")
+	catalogSectionXML.set("Number", device.catalogNumber)
 	catalogSectionXML.set("VisibleDescription", "")
 	catalogSectionXML.set("DefaultLanguage", "de-DE")
 	catalogSectionXML.set("NonRegRelevantDataVersion", "0")
 
 	catalogItemXML = ET.SubElement(catalogSectionXML, "CatalogItem")
-	catalogItemXML.set("Id", catalogItemId)
-	catalogItemXML.set("Name", srcDeviceXML.find("name").text)
-	addTranslations(languagesXML, srcDeviceXML.findall("name"), catalogItemId, catalogItemId, "Name")
-	catalogItemXML.set("Number", catalogItemNumber)
+	catalogItemXML.set("Id", device.catalogItemId)
+	catalogItemXML.set("Name", info.name.text)
+	translations.add(info.name, device.catalogItemId, device.catalogItemId, "Name")
+	catalogItemXML.set("Number", device.catalogItemNumber)
 	# According to spec: VisibleDescription. Missing?
-	catalogItemXML.set("ProductRefId", productId)
-	catalogItemXML.set("Hardware2ProgramRefId", hardware2ProgramId)
+	catalogItemXML.set("ProductRefId", device.productId)
+	catalogItemXML.set("Hardware2ProgramRefId", device.hardware2ProgramId)
 	catalogItemXML.set("DefaultLanguage", "de-DE")
 	catalogItemXML.set("NonRegRelevantDataVersion", "0")
 
-	manufacturerXML.append(languagesXML)
+	manufacturerXML.append(translations.createLanguagesNode())
 
 	return dstRootXML
 
-def createHardware(srcRootXML):
-	languagesXML = ET.Element("Languages")
-	srcDeviceXML = srcRootXML.find("info")
+def createHardware(device):
+	translations = Translations(device.profiler)
+	info = device.source.info
 	dstRootXML = createRootNode()
 	
 	manufacturerDataXML = ET.SubElement(dstRootXML, "ManufacturerData")
 	
 	manufacturerXML = ET.SubElement(manufacturerDataXML, "Manufacturer")
-	manufacturerXML.set("RefId", manufacturerId)
+	manufacturerXML.set("RefId", device.manufacturerId)
 
 	hardwaresXML = ET.SubElement(manufacturerXML, "Hardware")
 
 	hardwareXML = ET.SubElement(hardwaresXML, "Hardware")
-	hardwareXML.set("Id", hardwareId)
-	hardwareXML.set("Name", srcDeviceXML.find("name").text)
-	hardwareXML.set("SerialNumber", serialNumber)
-	hardwareXML.set("VersionNumber", versionNumber)
+	hardwareXML.set("Id", device.hardwareId)
+	hardwareXML.set("Name", info.name.text)
+	hardwareXML.set("SerialNumber", device.serialNumber)
+	hardwareXML.set("VersionNumber", device.versionNumber)
 	hardwareXML.set("BusCurrent", "12")
 	hardwareXML.set("IsAccessory", "0")
 	hardwareXML.set("HasIndividualAddress", "1")
@@ -188,14 +353,14 @@ def createHardware(srcRootXML):
 	productsXML = ET.SubElement(hardwareXML, "Products")
 
 	productXML = ET.SubElement(productsXML, "Product")
-	productXML.set("Id", productId)
-	productXML.set("Text", srcDeviceXML.find("name").text)
-	addTranslations(languagesXML, srcDeviceXML.findall("name"), productId, productId, "Name")
-	productXML.set("OrderNumber", orderNumber)
+	productXML.set("Id", device.productId)
+	productXML.set("Text", info.name.text)
+	translations.add(info.name, device.productId, device.productId, "Name")
+	productXML.set("OrderNumber", device.orderNumber)
 	productXML.set("IsRailMounted", "1")
 	productXML.set("WidthInMillimeter", "1.0500000e+002")
-	productXML.set("VisibleDescription", srcDeviceXML.find("name").text)
-	addTranslations(languagesXML, srcDeviceXML.findall("name"), productId, productId, "VisibleDescription")
+	productXML.set("VisibleDescription", info.name.text)
+	translations.add(info.name, device.productId, device.productId, "VisibleDescription")
 	productXML.set("DefaultLanguage", "de-DE")
 	productXML.set("Hash", "")
 	productXML.set("NonRegRelevantDataVersion", "0")
@@ -207,12 +372,12 @@ def createHardware(srcRootXML):
 	hardware2ProgramsXML = ET.SubElement(hardwareXML, "Hardware2Programs")
 
 	hardware2ProgramXML = ET.SubElement(hardware2ProgramsXML, "Hardware2Program")
-	hardware2ProgramXML.set("Id", hardware2ProgramId)
+	hardware2ProgramXML.set("Id", device.hardware2ProgramId)
 	hardware2ProgramXML.set("MediumTypes", "MT-0")
 	hardware2ProgramXML.set("Hash", "")
 
 	applicationProgramRefXML = ET.SubElement(hardware2ProgramXML, "ApplicationProgramRef")
-	applicationProgramRefXML.set("RefId", applicationProgramId)
+	applicationProgramRefXML.set("RefId", device.applicationProgramId)
 
 	# According to spec: Application Program 2 Ref. Missing?
 
@@ -220,32 +385,33 @@ def createHardware(srcRootXML):
 	registrationInfoXML.set("RegistrationStatus", "Registered")
 	registrationInfoXML.set("RegistrationSignature", "")
 
-	manufacturerXML.append(languagesXML)
+	manufacturerXML.append(translations.createLanguagesNode())
 
 	return dstRootXML
 
-def createProduct(srcRootXML):
-	languagesXML = ET.Element("Languages")
-	srcDeviceXML = srcRootXML.find("info")
+def createApplicationProgram(device, translations):
+	"""Return the KNX root and the Manufacturer and ApplicationProgram elements
+	of the application program file, without Static, Dynamic and Languages."""
+	info = device.source.info
 	dstRootXML = createRootNode()
 	
 	manufacturerDataXML = ET.SubElement(dstRootXML, "ManufacturerData")
 	
 	manufacturerXML = ET.SubElement(manufacturerDataXML, "Manufacturer")
-	manufacturerXML.set("RefId", manufacturerId)
+	manufacturerXML.set("RefId", device.manufacturerId)
 	
 	applicationProgramsXML = ET.SubElement(manufacturerXML, "ApplicationPrograms")
 
 	applicationProgramXML = ET.SubElement(applicationProgramsXML, "ApplicationProgram")
-	applicationProgramXML.set("Id", applicationProgramId)
-	applicationProgramXML.set("ApplicationNumber", applicationNumber)
-	applicationProgramXML.set("ApplicationVersion", applicationVersion)
+	applicationProgramXML.set("Id", device.applicationProgramId)
+	applicationProgramXML.set("ApplicationNumber", device.applicationNumber)
+	applicationProgramXML.set("ApplicationVersion", device.applicationVersion)
 	applicationProgramXML.set("ProgramType", "ApplicationProgram")
 	applicationProgramXML.set("MaskVersion", "MV-0705")
 	# According to spec: Visible Description. Missing?
-	applicationProgramXML.set("Name", srcDeviceXML.find("name").text)
-	addTranslations(languagesXML, srcDeviceXML.findall("name"), applicationProgramId, applicationProgramId, "Name")
-	applicationProgramXML.set("LoadProcedureStyle", "DefaultProcedure")
+	applicationProgramXML.set("Name", info.name.text)
+	translations.add(info.name, device.applicationProgramId, device.applicationProgramId, "Name")
+	applicationProgramXML.set("LoadProcedureStyle", "ProductProcedure" if device.productProcedure else "DefaultProcedure")
 	applicationProgramXML.set("PeiType", "0")
 	# According to spec: Serial Number. Missing?
 	# According to spec: Help Topic ID. Missing?
@@ -265,44 +431,199 @@ def createProduct(srcRootXML):
 	# Not in spec. Obsolete? applicationProgramXML.set("DownloadInfoIncomplete", "0")
 	# Not in spec. Obsolete? applicationProgramXML.set("CreatedFromLegacySchemaVersion", "0")
 
-	staticXML = ET.SubElement(applicationProgramXML, "Static")
+	return (dstRootXML, manufacturerXML, applicationProgramXML)
 
-	codeXML = ET.SubElement(staticXML, "Code")
-	parameterTypesXML = ET.SubElement(staticXML, "ParameterTypes")
-	parametersXML = ET.SubElement(staticXML, "Parameters")
-	parameterRefsXML = ET.SubElement(staticXML, "ParameterRefs")
-	comObjectTableXML = ET.SubElement(staticXML, "ComObjectTable")
-	comObjectRefsXML = ET.SubElement(staticXML, "ComObjectRefs")
-	addressTableXML = ET.SubElement(staticXML, "AddressTable")
-	associationTableXML = ET.SubElement(staticXML, "AssociationTable")
-	loadProceduresXML = ET.SubElement(staticXML, "LoadProcedures")
-	extensionXML = ET.SubElement(staticXML, "Extension")
-	optionsXML = ET.SubElement(staticXML, "Options")
+def createParameterType(parameter):
+	"""Return a ParameterType for parameter without Id, Name or enumeration ids."""
+	parameterTypeXML = ET.Element("ParameterType")
+	parameterTypeXML.set("Plugin", "")
 
-	dynamicXML = ET.SubElement(applicationProgramXML, "Dynamic")
+	type = parameter.type
+		
+	if (type == "unsignedInt") | (type == "signedInt"):
+		sizeInBit = parameter.sizeInBit
 
-	absoluteSegmentAddr = "16384"
-	absoluteSegmentId = applicationProgramId + "_AS-" + "%04X" % int(absoluteSegmentAddr)
-	absoluteSegmentXML = ET.SubElement(codeXML, "AbsoluteSegment")
-	absoluteSegmentXML.set("Id", absoluteSegmentId)
-	absoluteSegmentXML.set("Address", absoluteSegmentAddr)
-	absoluteSegmentXML.set("Size", "403")
-	absoluteSegmentXML.set("UserMemory", "0")
+		typeNumberXML = ET.SubElement(parameterTypeXML, "TypeNumber")
+		typeNumberXML.set("SizeInBit", sizeInBit)
+		
+		minInclusive = parameter.minInclusive
+		maxInclusive = parameter.maxInclusive
 
-	absoluteSegmentAddr = "16787"
-	absoluteSegmentId = applicationProgramId + "_AS-" + "%04X" % int(absoluteSegmentAddr)
-	absoluteSegmentXML = ET.SubElement(codeXML, "AbsoluteSegment")
-	absoluteSegmentXML.set("Id", absoluteSegmentId)
-	absoluteSegmentXML.set("Address", absoluteSegmentAddr)
-	absoluteSegmentXML.set("Size", "401")
-	absoluteSegmentXML.set("UserMemory", "0")
+		if (type == "unsignedInt"):
+			if minInclusive is None:
+				minInclusive = "0"
+
+			if maxInclusive is None:
+				maxInclusive = str((1 << int(sizeInBit)) - 1)
+
+			typeNumberXML.set("Type", "unsignedInt")
+		else:
+			if minInclusive is None:
+				minInclusive = "-" + str(1 << (int(sizeInBit) - 1))
+
+			if maxInclusive is None:
+				maxInclusive = str((1 << (int(sizeInBit) - 1)) - 1)
+
+			typeNumberXML.set("Type", "signedInt")
+
+		typeNumberXML.set("minInclusive", minInclusive)
+		typeNumberXML.set("maxInclusive", maxInclusive)
+		
+		if parameter.uiHint is not None:
+			typeNumberXML.set("UIHint", parameter.uiHint)
+	elif type == "float":
+		typeFloatXML = ET.SubElement(parameterTypeXML, "TypeFloat")
+
+		sizeInBit = parameter.sizeInBit;
+		minInclusive = parameter.minInclusive
+		maxInclusive = parameter.maxInclusive
+
+		if sizeInBit == "16":
+			encoding = "DPT 9"
+
+			if minInclusive is None:
+				minInclusive = "-671088.64"
+
+			if maxInclusive is None:
+				maxInclusive = "670760.96"
+
+		elif sizeInBit == "32":
+			encoding = "IEEE-754 Single"
+
+			if minInclusive is None:
+				minInclusive = "1.175e-38"
+
+			if maxInclusive is None:
+				maxInclusive = "3.4028235e+38"
+
+		elif sizeInBit == "64":
+			encoding = "IEEE-754 Double"
+
+			if minInclusive is None:
+				minInclusive = "2.2251e-308"
+			
+			if maxInclusive is None:
+				maxInclusive = "1.798e308"
+		else:
+			print "Unkown sizeInBit: " + sizeInBit
+				
+		typeFloatXML.set("Encoding", encoding)
+		typeFloatXML.set("minInclusive", minInclusive)
+		typeFloatXML.set("maxInclusive", maxInclusive)
+
+		if parameter.uiHint is not None:
+			typeFloatXML.set("UIHint", parameter.uiHint)
+	elif type == "text":
+		typeTextXML = ET.SubElement(parameterTypeXML, "TypeText")
+		typeTextXML.set("SizeInBit", parameter.sizeInBit)
+
+		if parameter.pattern is not None:
+			typeTextXML.set("Pattern", parameter.pattern)
+	elif type == "enumeration":
+		typeRestrictionXML = ET.SubElement(parameterTypeXML, "TypeRestriction")
+		typeRestrictionXML.set("Base", "Value")
+		typeRestrictionXML.set("SizeInBit", parameter.sizeInBit)
+			
+		for entry in parameter.entries:
+			enumerationXML = ET.SubElement(typeRestrictionXML, "Enumeration")
+			# Obsolete! enumerationXML.set("DisplayOrder", "")
+			enumerationXML.set("Text", entry.name.text)
+			enumerationXML.set("Value", entry.value)
+	else:
+		print type
+
+	return parameterTypeXML
+
+def parameterTypeDigest(parameterTypeXML, parameter):
+	"""SHA-1 over a parameter type definition and its enumeration texts in every language."""
+	parts = []
+
+	for elemXML in parameterTypeXML.iter():
+		parts.append(elemXML.tag)
+		for key, value in sorted(elemXML.items()):
+			parts.append(key + u"=" + value)
+
+	if parameter.entries is not None:
+		for entry in parameter.entries:
+			for countryCode, text in entry.name.translations:
+				parts.append(u"%s:%s=%s" % (entry.value, countryCode, text))
 
-	absoluteSegmentAddr = "17188"
-	absoluteSegmentId = applicationProgramId + "_AS-" + "%04X" % int(absoluteSegmentAddr)
+	return hashlib.sha1(u"\0".join(parts).encode("utf-8")).hexdigest()
+
+def parameterTypeIdFor(device, digest, usedIds):
+	"""Return the id of a new ParameterType, lengthening the digest prefix while it is in usedIds."""
+	length = 12
+
+	while device.applicationProgramId + "_PT-" + digest[:length] in usedIds:
+		length += 4
+
+	return device.applicationProgramId + "_PT-" + digest[:length]
+
+def addParameterType(device, parameterTypesXML, parameterTypeXML, parameterTypeId, parameter, translations):
+	parameterTypeXML.set("Id", parameterTypeId)
+	parameterTypeXML.set("Name", parameter.name.text)
+	parameterTypesXML.append(parameterTypeXML)
+
+	if parameterTypeXML.find("TypeRestriction") is None or parameter.entries is None:
+		return
+
+	for enumerationXML, entry in zip(parameterTypeXML.find("TypeRestriction"), parameter.entries):
+		enumerationId = parameterTypeId + "_EN-%s" % enumerationXML.get("Value")
+		enumerationXML.set("Id", enumerationId)
+		translations.add(entry.name, device.applicationProgramId, enumerationId, "Text")
+
+def parameterSizes(channel):
+	"""Return the sizeInBit of every parameter of channel, in walk order."""
+	sizes = []
+	entries = [entry for parameterBlock in channel.parameterBlocks for entry in parameterBlock.entries]
+	entries.reverse()
+
+	while entries:
+		entry = entries.pop()
+
+		if isinstance(entry, devicesource.Parameter):
+			sizes.append(int(entry.sizeInBit))
+
+			for when in reversed(entry.conditions):
+				entries.extend(reversed(when.entries))
+
+	return sizes
+
+def createMemoryLayout(device):
+	"""Return the MemoryLayout of the tables and parameters of device.
+
+	Every load state machine gets one segment. The application segment
+	holds the ComObject table at offset 0 and the parameters behind it at
+	parametersOffset. placements holds the Placement of every parameter in
+	walk order, relative to parametersOffset.
+	"""
+	sizes = []
+
+	# Every instance of a template has the sizes of the template
+	for channel in device.source.channels:
+		if isinstance(channel, devicesource.ChannelTemplate):
+			sizes.extend(parameterSizes(channel.channel) * channel.repeat)
+		else:
+			sizes.extend(parameterSizes(channel))
+
+	placements, parametersSize = memorylayout.packParameters(sizes)
+
+	allocator = memorylayout.SegmentAllocator(codeStartAddress)
+
+	return MemoryLayout(
+		allocator.allocate(memorylayout.addressTableSize(tableMaxEntries)),
+		allocator.allocate(memorylayout.associationTableSize(tableMaxEntries)),
+		allocator.allocate(comObjectTableSize + parametersSize),
+		comObjectTableSize,
+		placements,
+	)
+
+def addAbsoluteSegment(codeXML, device, segment):
+	absoluteSegmentId = device.applicationProgramId + "_AS-" + "%04X" % segment.address
 	absoluteSegmentXML = ET.SubElement(codeXML, "AbsoluteSegment")
 	absoluteSegmentXML.set("Id", absoluteSegmentId)
-	absoluteSegmentXML.set("Address", absoluteSegmentAddr)
-	absoluteSegmentXML.set("Size", "360")
+	absoluteSegmentXML.set("Address", str(segment.address))
+	absoluteSegmentXML.set("Size", str(segment.size))
 	absoluteSegmentXML.set("UserMemory", "0")
 
 	#dataXML = ET.SubElement(absoluteSegmentXML, "Data")
@@ -311,308 +632,730 @@ def createProduct(srcRootXML):
 	#maskXML = ET.SubElement(absoluteSegmentXML, "Mask")
 	#maskXML.text = ""
 
-	comObjectTableXML.set("CodeSegment", absoluteSegmentId)
-	comObjectTableXML.set("Offset", "0")
+	return absoluteSegmentId
 
-	srcChannelsXML = srcRootXML.find("channels")
-	parameterIdx = 0
-	parameterSeparatorIdx = 0
+def createLoadProcedure(loadProceduresXML, layout):
+	"""Add the product load procedure for the MV-0705 mask.
 
-	for srcChannelXML in srcChannelsXML:
-		channelXML = addChannel(dynamicXML, srcChannelXML.find("name").text)
-		addTranslations(languagesXML, srcChannelXML.findall("name"), applicationProgramId, channelXML.get("Id"), "Text")
+	Each load state machine writes its whole Code segment in a single
+	LdCtrlAbsSegment step.
+	"""
+	stateMachines = [
+		(lsmAddressTable, layout.addressTable),
+		(lsmAssociationTable, layout.associationTable),
+		(lsmApplication, layout.application),
+	]
 
-		srcParameterBlocksXML = srcChannelXML.find("parameterBlocks")
+	loadProcedureXML = ET.SubElement(loadProceduresXML, "LoadProcedure")
+	ET.SubElement(loadProcedureXML, "LdCtrlConnect")
 
-		for srcParameterBlockXML in srcParameterBlocksXML:
+	for lsmIdx, segment in stateMachines:
+		ET.SubElement(loadProcedureXML, "LdCtrlUnload").set("LsmIdx", str(lsmIdx))
 
-			parameterBlockXML = addParameterBlock(channelXML, srcParameterBlockXML.find("name").text)
-			addTranslations(languagesXML, srcParameterBlockXML.findall("name"), applicationProgramId, parameterBlockXML.get("Id"), "Text")
-		
-			srcParametersXML = srcParameterBlockXML.find("parameters")
-
-			for srcEntryXML in srcParametersXML:
-				if srcEntryXML.tag == "parameter":
-					parameterTypeName = srcEntryXML.find("name").text
-					parameterTypeId = applicationProgramId + "_PT-" + parameterTypeName.encode('iso9075')
-					parameterTypeXML = ET.SubElement(parameterTypesXML, "ParameterType")
-					parameterTypeXML.set("Id", parameterTypeId)
-					parameterTypeXML.set("Name", parameterTypeName)
-					parameterTypeXML.set("Plugin", "")
-					
-					type = srcEntryXML.get("type")
-						
-					if (type == "unsignedInt") | (type == "signedInt"):
-						sizeInBit = srcEntryXML.get("sizeInBit")
-
-						typeNumberXML = ET.SubElement(parameterTypeXML, "TypeNumber")
-						typeNumberXML.set("SizeInBit", sizeInBit)
-						
-						minInclusive = srcEntryXML.get("minInclusive")
-						maxInclusive = srcEntryXML.get("maxInclusive")
-
-						if (type == "unsignedInt"):
-							if minInclusive is None:
-								minInclusive = "0"
-
-							if maxInclusive is None:
-								maxInclusive = str((1 << int(sizeInBit)) - 1)
-
-							typeNumberXML.set("Type", "unsignedInt")
-						else:
-							if minInclusive is None:
-								minInclusive = "-" + str(1 << (int(sizeInBit) - 1))
-
-							if maxInclusive is None:
-								maxInclusive = str((1 << (int(sizeInBit) - 1)) - 1)
-
-							typeNumberXML.set("Type", "signedInt")
-
-						typeNumberXML.set("minInclusive", minInclusive)
-						typeNumberXML.set("maxInclusive", maxInclusive)
-						
-						if srcEntryXML.get("uiHint") is not None:
-							typeNumberXML.set("UIHint", srcEntryXML.get("uiHint"))
-					elif type == "float":
-						typeFloatXML = ET.SubElement(parameterTypeXML, "TypeFloat")
-
-						sizeInBit = srcEntryXML.get("sizeInBit");
-						minInclusive = srcEntryXML.get("minInclusive")
-						maxInclusive = srcEntryXML.get("maxInclusive")
-
-						if sizeInBit == "16":
-							encoding = "DPT 9"
-
-							if minInclusive is None:
-								minInclusive = "-671088.64"
-		
-							if maxInclusive is None:
-								maxInclusive = "670760.96"
-
-						elif sizeInBit == "32":
-							encoding = "IEEE-754 Single"
-
-							if minInclusive is None:
-								minInclusive = "1.175e-38"
-
-							if maxInclusive is None:
-								maxInclusive = "3.4028235e+38"
-
-						elif sizeInBit == "64":
-							encoding = "IEEE-754 Double"
-
-							if minInclusive is None:
-								minInclusive = "2.2251e-308"
-							
-							if maxInclusive is None:
-								maxInclusive = "1.798e308"
-						else:
-							print "Unkown sizeInBit: " + sizeInBit
-								
-						typeFloatXML.set("Encoding", encoding)
-						typeFloatXML.set("minInclusive", minInclusive)
-						typeFloatXML.set("maxInclusive", maxInclusive)
-
-						if srcEntryXML.get("uiHint") is not None:
-							typeFloatXML.set("UIHint", srcEntryXML.get("uiHint"))
-					elif type == "text":
-						typeTextXML = ET.SubElement(parameterTypeXML, "TypeText")
-						typeTextXML.set("SizeInBit", srcEntryXML.get("sizeInBit"))
-
-						if srcEntryXML.get("pattern") is not None:
-							typeTextXML.set("Pattern", srcEntryXML.get("pattern"))
-					elif type == "enumeration":
-						typeRestrictionXML = ET.SubElement(parameterTypeXML, "TypeRestriction")
-						typeRestrictionXML.set("Base", "Value")
-						typeRestrictionXML.set("SizeInBit", srcEntryXML.get("sizeInBit"))
-							
-						srcEntriesXML = srcEntryXML.find("entries")
-							
-						for srcListEntryXML in srcEntriesXML:
-							enumerationValue = srcListEntryXML.get("value")
-							enumerationId = parameterTypeId + "_EN-%s" % enumerationValue
-							enumerationXML = ET.SubElement(typeRestrictionXML, "Enumeration")
-							enumerationXML.set("Id", enumerationId)
-							# Obsolete! enumerationXML.set("DisplayOrder", "")
-							enumerationXML.set("Text", srcListEntryXML.find("name").text)
-							addTranslations(languagesXML, srcListEntryXML.findall("name"), applicationProgramId, enumerationId, "Text")
-							enumerationXML.set("Value", enumerationValue)
-					else:
-						print type
-
-
-					parameterIdx = parameterIdx + 1
-					parameterId = applicationProgramId + "_P-%d" % parameterIdx
-					parameterXML = ET.SubElement(parametersXML, "Parameter")
-					parameterXML.set("Id", parameterId)
-					parameterXML.set("Name", srcEntryXML.find("name").text)
-					parameterXML.set("ParameterType", parameterTypeId)
-					parameterXML.set("Text", srcEntryXML.find("name").text)
-					addTranslations(languagesXML, srcEntryXML.findall("name"), applicationProgramId, parameterId, "Text")
-					# According to spec: SuffixText. Missing?
-					parameterXML.set("Access", "ReadWrite")
-					parameterXML.set("Value", srcEntryXML.get("default"))
-					# According to spec: Patch Always. Missing?
-					# According to spec: Unique Number. Missing?
-					
-					#memoryXML = ET.SubElement(parameterXML, "Memory")
-					#memoryXML.set("CodeSegment", "")
-					#memoryXML.set("Offset", "0")
-					#memoryXML.set("BitOffset", "0")
-					
-					#propertyXML = ET.SubElement(parameterXML, "Property")
-					#propertyXML.set("ObjectIndex", "0")
-					#propertyXML.set("PropertyId", "0")
-					#propertyXML.set("Offset", "0")
-					#propertyXML.set("BitOffset", "0")
-					
-					parameterRefId = parameterId + "_R-1"
-					parameterRefXML = ET.SubElement(parameterRefsXML, "ParameterRef")
-					parameterRefXML.set("Id", parameterRefId)
-					parameterRefXML.set("RefId", parameterId)
-					# According to spec: Text. Missing?
-					# According to spec: SuffixText. Missing?
-					# Obsolete! parameterRefXML.set("DisplayOrder", "1")
-					# According to spec: Access. Missing?
-					# According to spec: Default Value. Missing?
-					parameterRefXML.set("Tag", "1")
-				
-					parameterRefRefXML = ET.SubElement(parameterBlockXML, "ParameterRefRef")
-					parameterRefRefXML.set("RefId", parameterRefId)
-
-				elif srcEntryXML.tag == "parameterSeparator":
-					parameterSeparatorIdx += + 1
-					parameterSeparatorId = applicationProgramId + "_PS-%d" % parameterSeparatorIdx
-					parameterSeparatorXML = ET.SubElement(parameterBlockXML, "ParameterSeparator")
-					parameterSeparatorXML.set("Id", parameterSeparatorId)
-					parameterSeparatorText = srcEntryXML.find("text")
-					if parameterSeparatorText is None:
-						parameterSeparatorXML.set("Text", "")
-					else:
-						parameterSeparatorXML.set("Text", srcEntryXML.find("text").text)
-						addTranslations(languagesXML, srcEntryXML.findall("text"), applicationProgramId, parameterSeparatorId, "Text")
-					# According to spec: Access. Missing?
-
-				else:
-					print "Unknown tag: " + srcEntryXML.tag
-
-	srcParametersXML = srcRootXML.find("comObjects")
-	comObjectIdx = -1
-	comObjectRefIdx = 0
+	for lsmIdx, segment in stateMachines:
+		ET.SubElement(loadProcedureXML, "LdCtrlLoad").set("LsmIdx", str(lsmIdx))
 
-	channelIndependentBlockXML = ET.SubElement(dynamicXML, "ChannelIndependentBlock")
+		absSegmentXML = ET.SubElement(loadProcedureXML, "LdCtrlAbsSegment")
+		absSegmentXML.set("LsmIdx", str(lsmIdx))
+		absSegmentXML.set("SegType", "0")
+		absSegmentXML.set("Address", str(segment.address))
+		absSegmentXML.set("Size", str(segment.size))
+		absSegmentXML.set("Access", "0")
+		absSegmentXML.set("MemType", "2")
+		absSegmentXML.set("SegFlags", "0")
 
-	for srcEntryXML in srcParametersXML:
-		if srcEntryXML.tag == "comObject":
+		# The application runs from the segment its state machine loads
+		if lsmIdx == lsmApplication:
+			taskSegmentXML = ET.SubElement(loadProcedureXML, "LdCtrlTaskSegment")
+			taskSegmentXML.set("LsmIdx", str(lsmIdx))
+			taskSegmentXML.set("Address", str(segment.address))
 
-			datapointTypeXML = masterRoot.find(".//knx:DatapointSubtype[@Id='" + srcEntryXML.find("datapointType").text + "']/../..", knxns)
-			datapointSubtypeXML = masterRoot.find(".//knx:DatapointSubtype[@Id='" + srcEntryXML.find("datapointType").text + "']", knxns)
-			bitSize = int(datapointTypeXML.get("SizeInBit"))
-			
-			if bitSize < 8:
-				objectSize = "%d Bit" % bitSize
-			elif bitSize == 8:
-				objectSize = "1 Byte"
-			elif (bitSize % 8) == 0:
-				objectSize = "%d Bytes" % (bitSize / 8)
-			else:
-				print "Unknown bitsize: %d bits" % bitSize
-			
-			comObjectIdx += + 1
-			comObjectId = applicationProgramId + "_O-%d" % comObjectIdx
-			comObjectXML = ET.SubElement(comObjectTableXML, "ComObject")
-			comObjectXML.set("Id", comObjectId)
-			comObjectXML.set("Name", srcEntryXML.find("name").text)
-			comObjectXML.set("Text", srcEntryXML.find("name").text)
-			addTranslations(languagesXML, srcEntryXML.findall("name"), applicationProgramId, comObjectId, "Text")
-			comObjectXML.set("Number", str(comObjectIdx))
-			comObjectXML.set("FunctionText", srcEntryXML.find("function").text)
-			addTranslations(languagesXML, srcEntryXML.findall("function"), applicationProgramId, comObjectId, "FunctionText")
-			comObjectXML.set("Priority", "Low")
-			comObjectXML.set("ObjectSize", objectSize)
-
-			if srcEntryXML.find("readFlag") is None:
-				comObjectXML.set("ReadFlag", "Disabled")
-			else:
-				comObjectXML.set("ReadFlag", "Enabled")
+		ET.SubElement(loadProcedureXML, "LdCtrlLoadCompleted").set("LsmIdx", str(lsmIdx))
 
-			if srcEntryXML.find("writeFlag") is None:
-				comObjectXML.set("WriteFlag", "Disabled")
-			else:
-				comObjectXML.set("WriteFlag", "Enabled")
+	ET.SubElement(loadProcedureXML, "LdCtrlRestart")
+	ET.SubElement(loadProcedureXML, "LdCtrlDisconnect")
 
-			comObjectXML.set("CommunicationFlag", "Enabled")
+def createStatic(device, translations):
+	staticXML = ET.Element("Static")
 
-			if srcEntryXML.find("transmitFlag") is None:
-				comObjectXML.set("TransmitFlag", "Disabled")
-			else:
-				comObjectXML.set("TransmitFlag", "Enabled")
+	codeXML = ET.SubElement(staticXML, "Code")
+	parameterTypesXML = ET.SubElement(staticXML, "ParameterTypes")
+	parametersXML = ET.SubElement(staticXML, "Parameters")
+	parameterRefsXML = ET.SubElement(staticXML, "ParameterRefs")
+	comObjectTableXML = ET.SubElement(staticXML, "ComObjectTable")
+	comObjectRefsXML = ET.SubElement(staticXML, "ComObjectRefs")
+	addressTableXML = ET.SubElement(staticXML, "AddressTable")
+	associationTableXML = ET.SubElement(staticXML, "AssociationTable")
+	loadProceduresXML = ET.SubElement(staticXML, "LoadProcedures")
+	extensionXML = ET.SubElement(staticXML, "Extension")
+	optionsXML = ET.SubElement(staticXML, "Options")
+
+	layout = createMemoryLayout(device)
 
-			comObjectXML.set("UpdateFlag", "Enabled")
-			comObjectXML.set("ReadOnInitFlag", "Disabled")
-			comObjectXML.set("DatapointType", srcEntryXML.find("datapointType").text)
-			# Not in spec. Obsolete? comObjectXML.set("VisibleDescription", "")
+	addressTableSegmentId = addAbsoluteSegment(codeXML, device, layout.addressTable)
+	associationTableSegmentId = addAbsoluteSegment(codeXML, device, layout.associationTable)
+	applicationSegmentId = addAbsoluteSegment(codeXML, device, layout.application)
+
+	comObjectTableXML.set("CodeSegment", applicationSegmentId)
+	comObjectTableXML.set("Offset", "0")
+
+	# By digest, and the digests by the ids that only hold a prefix of them
+	parameterTypeIds = {}
+	parameterTypeDigests = {}
+	# Parameters with identical type definitions share one ParameterType. The
+	# instances of a template also share the entries of each parameter, so
+	# only its first instance has to hash them
+	parameterTypeIdsByDefinition = {}
+	parameterTypeIdsByShape = {}
+	lookupDatapoint = device.profiler.wrap("datapointLookup", device.datapointIndex.lookup)
+
+	# Translations for the Dynamic section are added here as well, so the
+	# Languages section keeps the source order
+	for tag, entryId, entry in walkChannels(device):
+		if tag == "channel" or tag == "parameterBlock":
+			translations.add(entry.name, device.applicationProgramId, entryId, "Text")
+
+		elif tag == "parameter":
+			shape = (entry.type, entry.sizeInBit, entry.minInclusive, entry.maxInclusive, entry.uiHint, entry.pattern, id(entry.entries))
+			parameterTypeId = parameterTypeIdsByShape.get(shape)
+
+			if parameterTypeId is None:
+				definition = entry._replace(name=None, default=None, conditions=None)
+				parameterTypeId = parameterTypeIdsByDefinition.get(definition)
+
+			if parameterTypeId is None:
+				parameterTypeXML = createParameterType(entry)
+				digest = parameterTypeDigest(parameterTypeXML, entry)
+				parameterTypeId = parameterTypeIds.get(digest)
+
+				if parameterTypeId is None:
+					parameterTypeId = parameterTypeIdFor(device, digest, parameterTypeDigests)
+					parameterTypeIds[digest] = parameterTypeId
+					parameterTypeDigests[parameterTypeId] = digest
+					addParameterType(device, parameterTypesXML, parameterTypeXML, parameterTypeId, entry, translations)
+
+				parameterTypeIdsByDefinition[definition] = parameterTypeId
+
+			parameterTypeIdsByShape[shape] = parameterTypeId
+
+			parameterId = entryId
+			parameterXML = ET.SubElement(parametersXML, "Parameter")
+			parameterXML.set("Id", parameterId)
+			parameterXML.set("Name", entry.name.text)
+			parameterXML.set("ParameterType", parameterTypeId)
+			parameterXML.set("Text", entry.name.text)
+			translations.add(entry.name, device.applicationProgramId, parameterId, "Text")
+			# According to spec: SuffixText. Missing?
+			parameterXML.set("Access", "ReadWrite")
+			parameterXML.set("Value", entry.default)
+			# According to spec: Patch Always. Missing?
+			# According to spec: Unique Number. Missing?
+			
+			placement = layout.placements[device.parameterIdx - 1]
+			memoryXML = ET.SubElement(parameterXML, "Memory")
+			memoryXML.set("CodeSegment", applicationSegmentId)
+			memoryXML.set("Offset", str(layout.parametersOffset + placement.offset))
+			memoryXML.set("BitOffset", str(placement.bitOffset))
 			
-			comObjectRefIdx += 1
-			comObjectRefId = comObjectId + "_R-%d" % comObjectRefIdx
-			comObjectRefXML = ET.SubElement(comObjectRefsXML, "ComObjectRef")
-			comObjectRefXML.set("Id", comObjectRefId)
-			comObjectRefXML.set("RefId", comObjectId)
-			# According to spec: Name. Missing?
+			#propertyXML = ET.SubElement(parameterXML, "Property")
+			#propertyXML.set("ObjectIndex", "0")
+			#propertyXML.set("PropertyId", "0")
+			#propertyXML.set("Offset", "0")
+			#propertyXML.set("BitOffset", "0")
+			
+			parameterRefId = parameterId + "_R-1"
+			parameterRefXML = ET.SubElement(parameterRefsXML, "ParameterRef")
+			parameterRefXML.set("Id", parameterRefId)
+			parameterRefXML.set("RefId", parameterId)
 			# According to spec: Text. Missing?
-			# According to spec: Function Text. Missing?
-			# According to spec: Priority. Missing?
-			# According to spec: Object Size. Missing?
-			# According to spec: Read Flag. Missing?
-			# According to spec: Write Flag. Missing?
-			# According to spec: Communication Flag. Missing?
-			# According to spec: Transmit Flag. Missing?
-			# According to spec: Update Flag. Missing?
-			# According to spec: ReadOnInit Flag. Missing?
-			#comObjectRefXML.set("DatapointType", "DPST-10-1")
-			comObjectRefXML.set("Tag", str(comObjectRefIdx))
-
-			comObjectRefRefXML = ET.SubElement(channelIndependentBlockXML, "ComObjectRefRef")
-			comObjectRefRefXML.set("RefId", comObjectRefId)
-
-	addressTableXML.set("CodeSegment", applicationProgramId + "_AS-4000")
+			# According to spec: SuffixText. Missing?
+			# Obsolete! parameterRefXML.set("DisplayOrder", "1")
+			# According to spec: Access. Missing?
+			# According to spec: Default Value. Missing?
+			parameterRefXML.set("Tag", "1")
+
+		elif tag == "parameterSeparator":
+			translations.add(entry.text, device.applicationProgramId, entryId, "Text")
+
+	for number, comObjectId, comObjectRefId, comObject in walkComObjects(device):
+		datapointTypeId, bitSize = lookupDatapoint(comObject.datapointType)
+		
+		if bitSize < 8:
+			objectSize = "%d Bit" % bitSize
+		elif bitSize == 8:
+			objectSize = "1 Byte"
+		elif (bitSize % 8) == 0:
+			objectSize = "%d Bytes" % (bitSize / 8)
+		else:
+			print "Unknown bitsize: %d bits" % bitSize
+		
+		comObjectXML = ET.SubElement(comObjectTableXML, "ComObject")
+		comObjectXML.set("Id", comObjectId)
+		comObjectXML.set("Name", comObject.name.text)
+		comObjectXML.set("Text", comObject.name.text)
+		translations.add(comObject.name, device.applicationProgramId, comObjectId, "Text")
+		comObjectXML.set("Number", str(number))
+		comObjectXML.set("FunctionText", comObject.function.text)
+		translations.add(comObject.function, device.applicationProgramId, comObjectId, "FunctionText")
+		comObjectXML.set("Priority", "Low")
+		comObjectXML.set("ObjectSize", objectSize)
+
+		if not comObject.readFlag:
+			comObjectXML.set("ReadFlag", "Disabled")
+		else:
+			comObjectXML.set("ReadFlag", "Enabled")
+
+		if not comObject.writeFlag:
+			comObjectXML.set("WriteFlag", "Disabled")
+		else:
+			comObjectXML.set("WriteFlag", "Enabled")
+
+		comObjectXML.set("CommunicationFlag", "Enabled")
+
+		if not comObject.transmitFlag:
+			comObjectXML.set("TransmitFlag", "Disabled")
+		else:
+			comObjectXML.set("TransmitFlag", "Enabled")
+
+		comObjectXML.set("UpdateFlag", "Enabled")
+		comObjectXML.set("ReadOnInitFlag", "Disabled")
+		comObjectXML.set("DatapointType", comObject.datapointType)
+		# Not in spec. Obsolete? comObjectXML.set("VisibleDescription", "")
+		
+		comObjectRefXML = ET.SubElement(comObjectRefsXML, "ComObjectRef")
+		comObjectRefXML.set("Id", comObjectRefId)
+		comObjectRefXML.set("RefId", comObjectId)
+		# According to spec: Name. Missing?
+		# According to spec: Text. Missing?
+		# According to spec: Function Text. Missing?
+		# According to spec: Priority. Missing?
+		# According to spec: Object Size. Missing?
+		# According to spec: Read Flag. Missing?
+		# According to spec: Write Flag. Missing?
+		# According to spec: Communication Flag. Missing?
+		# According to spec: Transmit Flag. Missing?
+		# According to spec: Update Flag. Missing?
+		# According to spec: ReadOnInit Flag. Missing?
+		#comObjectRefXML.set("DatapointType", "DPST-10-1")
+		comObjectRefXML.set("Tag", str(number + 1))
+
+	addressTableXML.set("CodeSegment", addressTableSegmentId)
 	addressTableXML.set("Offset", "0")
-	addressTableXML.set("MaxEntries", "200")
+	addressTableXML.set("MaxEntries", str(tableMaxEntries))
 
-	associationTableXML.set("CodeSegment", applicationProgramId + "_AS-4193")
+	associationTableXML.set("CodeSegment", associationTableSegmentId)
 	associationTableXML.set("Offset", "0")
-	associationTableXML.set("MaxEntries", "200")
+	associationTableXML.set("MaxEntries", str(tableMaxEntries))
+
+	if device.productProcedure:
+		createLoadProcedure(loadProceduresXML, layout)
 
 	optionsXML.set("TextParameterEncodingSelector", "UseTextParameterEncodingCodePage")
 	optionsXML.set("TextParameterEncoding", "utf-8")
 
-	#chooseXML = ET.SubElement(parameterBlockXML, "choose")
-	#chooseXML.set("ParamRefId", parameterRefId)
+	return staticXML
+
+def createDynamic(device):
+	dynamicXML = ET.Element("Dynamic")
+	# Elements to return to at the end of a choose or when
+	parentsXML = []
+
+	for tag, entryId, entry in walkChannels(device):
+		if tag == "channel":
+			channelXML = addChannel(dynamicXML, entryId, device.channelIdx, entry.name.text)
 
-	#whenXML = ET.SubElement(chooseXML, "when")
-	#whenXML.set("test", "1")
+		elif tag == "parameterBlock":
+			parentXML = addParameterBlock(channelXML, entryId, entry.name.text)
 
-	manufacturerXML.append(languagesXML)
+		elif tag == "parameter":
+			parameterRefRefXML = ET.SubElement(parentXML, "ParameterRefRef")
+			parameterRefRefXML.set("RefId", entryId + "_R-1")
+
+		elif tag == "choose":
+			parentsXML.append(parentXML)
+			parentXML = ET.SubElement(parentXML, "choose")
+			parentXML.set("ParamRefId", entryId + "_R-1")
+
+		elif tag == "when":
+			parentsXML.append(parentXML)
+			parentXML = ET.SubElement(parentXML, "when")
+			parentXML.set("test", entry.test)
+
+		elif tag == "end":
+			parentXML = parentsXML.pop()
+
+		elif tag == "parameterSeparator":
+			parameterSeparatorXML = ET.SubElement(parentXML, "ParameterSeparator")
+			parameterSeparatorXML.set("Id", entryId)
+			if not entry.text.translations:
+				parameterSeparatorXML.set("Text", "")
+			else:
+				parameterSeparatorXML.set("Text", entry.text.text)
+			# According to spec: Access. Missing?
+
+	channelIndependentBlockXML = ET.SubElement(dynamicXML, "ChannelIndependentBlock")
+
+	for number, comObjectId, comObjectRefId, comObject in walkComObjects(device):
+		comObjectRefRefXML = ET.SubElement(channelIndependentBlockXML, "ComObjectRefRef")
+		comObjectRefRefXML.set("RefId", comObjectRefId)
+
+	return dynamicXML
+
+def createProduct(device):
+	profiler = device.profiler
+	translations = Translations(profiler)
+	dstRootXML, manufacturerXML, applicationProgramXML = createApplicationProgram(device, translations)
+
+	with profiler.stage("createStatic"):
+		applicationProgramXML.append(createStatic(device, translations))
+
+	with profiler.stage("createDynamic"):
+		applicationProgramXML.append(createDynamic(device))
+
+	with profiler.stage("createLanguages"):
+		manufacturerXML.append(translations.createLanguagesNode())
 
 	return dstRootXML
 
-catalogXML = createCatalog(root)
+def serializeProduct(device, out, compact=False):
+	"""Write the application program file section by section to out.
+
+	Static, Dynamic and Languages are each built, written and dropped in
+	turn, so only one of them is held in memory at a time.
+	"""
+	profiler = device.profiler
+	translations = Translations(profiler)
+	dstRootXML, manufacturerXML, applicationProgramXML = createApplicationProgram(device, translations)
+
+	writer = xmlwriter.XMLWriter(out, indent=None if compact else "  ")
+	writer.startDocument()
+
+	# KNX, ManufacturerData, Manufacturer, ApplicationPrograms, ApplicationProgram
+	elemXML = dstRootXML
+	while elemXML is not None:
+		writer.startElement(elemXML.tag, elemXML.attrib)
+		elemXML = elemXML.find("*")
+
+	def writeSection(name, create):
+		# The section is dropped on return, before the next one is built
+		with profiler.stage(name):
+			sectionXML = create()
+
+		with profiler.stage("write"):
+			writer.writeElement(sectionXML)
+
+	writeSection("createStatic", lambda: createStatic(device, translations))
+	writeSection("createDynamic", lambda: createDynamic(device))
+	writer.endElement("ApplicationProgram")
+	writer.endElement("ApplicationPrograms")
+
+	writeSection("createLanguages", translations.createLanguagesNode)
+	writer.endElement("Manufacturer")
+	writer.endElement("ManufacturerData")
+	writer.endElement("KNX")
+	writer.endDocument()
+
+	profiler.count("elements", writer.elementCount)
+	profiler.count("bytes", out.tell())
+
+def writeProduct(device, path, compact=False):
+	with open(path, "wb") as f:
+		serializeProduct(device, f, compact)
+
+def serializeTree(rootXML, out, compact=False, profiler=profiling.nullProfiler):
+	# Indentation is done by the writer, the tree itself is left untouched
+	with profiler.stage("write"):
+		writer = xmlwriter.XMLWriter(out, indent=None if compact else "  ")
+		writer.startDocument()
+		writer.writeElement(rootXML)
+		writer.endDocument()
+
+	profiler.count("elements", writer.elementCount)
+	profiler.count("bytes", out.tell())
+
+def writeTree(rootXML, path, compact=False, profiler=profiling.nullProfiler):
+	with open(path, "wb") as f:
+		serializeTree(rootXML, f, compact, profiler)
+
+def createArtifacts(device):
+	"""Return (file name, root element) of every file generated for device."""
+	return [
+		("Catalog.xml", createCatalog(device)),
+		("Hardware.xml", createHardware(device)),
+		(device.applicationProgramId + ".xml", createProduct(device)),
+	]
+
+def artifactInputs(device, options):
+	"""Return {file name: input hash} with everything each generated file depends on."""
+	source = device.source
+
+	common = buildcache.InputHash()
+	common.addValue(generatorHash)
+	common.addValue(sorted(options.items()))
+	common.addValue(device.manufacturerId)
+	common.addValue(source.info)
+	common = common.hexdigest()
+
+	catalogHash = buildcache.InputHash()
+	catalogHash.addValue(("Catalog", common))
+
+	hardwareHash = buildcache.InputHash()
+	hardwareHash.addValue(("Hardware", common))
+
+	productHash = buildcache.InputHash()
+	productHash.addValue(("ApplicationProgram", common))
+	productHash.addValue(source.channels)
+	productHash.addValue(source.comObjects)
+
+	# Only the master entries that are actually referenced
+	for comObject in source.comObjects:
+		productHash.addValue(device.datapointIndex.lookup(comObject.datapointType))
+
+	return {
+		"Catalog.xml": catalogHash.hexdigest(),
+		"Hardware.xml": hardwareHash.hexdigest(),
+		device.applicationProgramId + ".xml": productHash.hexdigest(),
+	}
+
+def deviceSerializers(device, stream=False, compact=False):
+	"""Return (file name, serialize) for every file generated for device.
+
+	serialize(out) builds the file and writes it to a binary file object.
+	"""
+	profiler = device.profiler
+	productFileName = device.applicationProgramId + ".xml"
+
+	def createTimed(name, create):
+		with profiler.stage(name):
+			return create(device)
+
+	serializers = [
+		("Catalog.xml", lambda out: serializeTree(createTimed("createCatalog", createCatalog), out, compact, profiler)),
+		("Hardware.xml", lambda out: serializeTree(createTimed("createHardware", createHardware), out, compact, profiler)),
+	]
+
+	if stream:
+		serializers.append((productFileName, lambda out: serializeProduct(device, out, compact)))
+	else:
+		serializers.append((productFileName, lambda out: serializeTree(createProduct(device), out, compact, profiler)))
+
+	return serializers
+
+def renderDevice(srcData, manufacturerId="M-013A", stream=False, compact=False, package=False, productProcedure=False):
+	"""Generate the device source document srcData without touching the disk.
+
+	Returns [(file name, contents)], or with package set the contents of
+	the .knxprod archive.
+	"""
+	device = DeviceContext(devicesource.readDevice(ET.fromstring(srcData)), manufacturerId, productProcedure=productProcedure)
+	serializers = deviceSerializers(device, stream, compact)
+
+	if package:
+		out = io.BytesIO()
+		knxprod.serializePackage(out, device.manufacturerId, serializers)
+		return out.getvalue()
+
+	files = []
+
+	for fileName, serialize in serializers:
+		out = io.BytesIO()
+		serialize(out)
+		files.append((fileName, out.getvalue()))
+
+	return files
+
+def packageName(srcPath):
+	return os.path.splitext(os.path.basename(srcPath))[0] + ".knxprod"
+
+def generateDevice(srcPath, outputDir, manufacturerId="M-013A", datapointIndex=None, stream=False, compact=False, force=False, profiler=None, package=False, canonical=False, productProcedure=False):
+	"""Generate the files of one device into outputDir.
+
+	Files whose inputs did not change since the last run are left alone,
+	unless force is set. Returns the names of the files that were written.
+	A profiling.Profiler passed as profiler collects the time spent per stage.
+	With package set, the files are only written into a .knxprod archive
+	named after the source file.
+
+	With canonical set, the output only depends on the source, the master
+	and the generator: files are compact, archives are dated
+	canonicalDateTime, and every file gets its SHA-1 in a .sha1 file.
+
+	With productProcedure set, the application program declares its own
+	load procedure instead of using the default one of the mask.
+	"""
+	if profiler is None:
+		profiler = profiling.nullProfiler
+
+	if canonical:
+		compact = True
+
+	device = loadDevice(srcPath, manufacturerId, datapointIndex, profiler, productProcedure)
+
+	if not os.path.isdir(outputDir):
+		os.makedirs(outputDir)
+
+	# A no-op once loaded, but the first device would otherwise pay for it in
+	# datapointLookup. Devices without ComObjects never need the master.
+	if device.source.comObjects:
+		with profiler.stage("masterLoad"):
+			device.datapointIndex.load()
+
+	with profiler.stage("inputHash"):
+		manifest = buildcache.Manifest(outputDir)
+		options = {"compact": compact}
+
+		# Only part of the options when set, caches of earlier runs stay valid
+		if canonical:
+			options["canonical"] = True
+
+		if productProcedure:
+			options["productProcedure"] = True
+
+		inputs = artifactInputs(device, options)
+
+	serializers = deviceSerializers(device, stream, compact)
+
+	if package:
+		# The archive depends on everything its files depend on
+		packageHash = buildcache.InputHash()
+		packageHash.addValue(sorted(inputs.items()))
+		inputs = {packageName(srcPath): packageHash.hexdigest()}
+		dateTime = canonicalDateTime if canonical else None
+		builders = [(packageName(srcPath), lambda out: knxprod.serializePackage(out, device.manufacturerId, serializers, dateTime))]
+	else:
+		builders = serializers
+
+	written = []
+
+	for fileName, serialize in builders:
+		if not force and manifest.upToDate(fileName, inputs[fileName]):
+			profiler.count("upToDate")
+			continue
+
+		outputHash = writeFile(os.path.join(outputDir, fileName), serialize, canonical)
+		manifest.update(fileName, inputs[fileName], outputHash)
+		written.append(fileName)
+
+	if written:
+		manifest.save()
+
+	return written
+
+def writeFile(path, serialize, contentHash=False):
+	"""Write path through serialize(out) and return its SHA-1, with
+	contentHash set also to the .sha1 file next to it."""
+	with open(path, "wb") as f:
+		out = buildcache.HashingFile(f)
+		serialize(out)
+
+	if contentHash:
+		buildcache.writeContentHash(path, out.hexdigest())
+
+	return out.hexdigest()
+
+def isDeviceSource(path):
+	"""True if the root element of the XML file path is <device>."""
+	try:
+		for event, elemXML in ET.iterparse(path, events=("start",)):
+			return elemXML.tag == "device"
+	except (SyntaxError, IOError):
+		return False
+
+	return False
+
+def findSources(paths, masterPath=None):
+	"""Return the device sources named by paths.
+
+	Files are taken as given. Of the XML files in a directory only device
+	sources are taken, so the master and generated files next to them are
+	skipped.
+	"""
+	srcPaths = []
+	masterPath = masterPath and os.path.realpath(masterPath)
+
+	for path in paths:
+		if os.path.isdir(path):
+			for srcPath in sorted(glob.glob(os.path.join(path, "*.xml"))):
+				if os.path.realpath(srcPath) != masterPath and isDeviceSource(srcPath):
+					srcPaths.append(srcPath)
+		else:
+			srcPaths.append(path)
+
+	return srcPaths
+
+def deviceOutputDir(srcPath, outputRoot, batch):
+	# A single source file keeps the old layout, everything else gets one folder per device
+	if batch:
+		return os.path.join(outputRoot, os.path.splitext(os.path.basename(srcPath))[0])
+
+	return outputRoot
+
+def initWorker(masterPath):
+	global sharedDatapointIndex
+
+	# Forked workers inherit the index the parent has already loaded, others read the on-disk index
+	if sharedDatapointIndex.masterPath != masterPath:
+		sharedDatapointIndex = knxmaster.DatapointIndex(masterPath)
+
+def runDevice(job):
+	srcPath, outputDir, options, profile = job
+	# Reports instead of profilers are returned, they have to cross process boundaries
+	profiler = profiling.Profiler() if profile else None
+	startTime = time.time()
+
+	try:
+		written = generateDevice(srcPath, outputDir, profiler=profiler, **options)
+	except Exception:
+		return (srcPath, time.time() - startTime, None, traceback.format_exc(), None)
+
+	return (srcPath, time.time() - startTime, written, None, profiler and profiler.report())
+
+def writeProfile(path, results, totalSeconds):
+	total = profiling.Profiler()
+	devices = []
+
+	for srcPath, seconds, written, error, report in results:
+		if report is None:
+			continue
+
+		total.merge(report)
+		devices.append(collections.OrderedDict([("source", srcPath), ("seconds", seconds), ("profile", report)]))
+
+	profile = collections.OrderedDict([
+		("seconds", totalSeconds),
+		("total", total.report()),
+		("devices", devices),
+	])
+
+	with open(path, "w") as f:
+		json.dump(profile, f, indent=2)
+
+def reportResults(results, totalSeconds, verbose):
+	"""Print the errors of results, and with verbose a line per device.
+
+	Returns the number of devices that failed.
+	"""
+	failed = 0
+
+	for srcPath, seconds, written, error, report in results:
+		if error is not None:
+			failed += 1
+			sys.stderr.write("%s: generation failed\n%s" % (srcPath, error))
+
+	if verbose:
+		for srcPath, seconds, written, error, report in results:
+			if error is not None:
+				status = "FAILED"
+			elif written:
+				status = "%d written" % len(written)
+			else:
+				status = "up to date"
+
+			print "%-50s %8.1f ms  %s" % (srcPath, seconds * 1000, status)
+
+		print "%-50s %8.1f ms" % ("total (%d devices, %d failed)" % (len(results), failed), totalSeconds * 1000)
+
+	return failed
+
+def watchSources(sources, masterPath, outputRoot, batch, options):
+	"""Regenerate every device whose source changes, until interrupted.
+
+	The interpreter, the generator and the datapoint index stay loaded, so
+	a change only costs the regeneration of the devices it affects. A
+	changed master reloads the index and regenerates every device, the
+	build cache then only rewrites the files it actually affects.
+	"""
+	global sharedDatapointIndex
+
+	watcher = filewatch.createWatcher(list(sources) + [masterPath])
+	print "Watching %s (%s), press Ctrl-C to stop" % (", ".join(sources), watcher.name)
+	sys.stdout.flush()
+
+	try:
+		while True:
+			changed = set(os.path.normpath(path) for path in watcher.wait())
+			startTime = time.time()
+			srcPaths = findSources(sources, masterPath)
+
+			if os.path.normpath(masterPath) in changed:
+				sharedDatapointIndex = knxmaster.DatapointIndex(masterPath)
+				sharedDatapointIndex.load()
+			else:
+				srcPaths = [srcPath for srcPath in srcPaths if os.path.normpath(srcPath) in changed]
+
+			if not srcPaths:
+				continue
+
+			results = [runDevice((srcPath, deviceOutputDir(srcPath, outputRoot, batch), options, False)) for srcPath in srcPaths]
+			reportResults(results, time.time() - startTime, True)
+			sys.stdout.flush()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		watcher.close()
+
+def main(argv=None):
+	global sharedDatapointIndex
+
+	parser = argparse.ArgumentParser(description="Generate KNX product database XML from device sources.")
+	parser.add_argument("sources", nargs="*", default=["testdev.xml"], help="device source XML files or directories containing them (default: testdev.xml)")
+	parser.add_argument("-o", "--output", default=".", help="output root directory (default: current directory)")
+	parser.add_argument("-m", "--master", default="knx_master.xml", help="path to knx_master.xml")
+	parser.add_argument("--manufacturer", default="M-013A", help="manufacturer id (default: M-013A)")
+	parser.add_argument("--stream", action="store_true", help="write the application program section by section instead of building it in memory")
+	parser.add_argument("--compact", action="store_true", help="write the files without any indentation whitespace")
+	parser.add_argument("--package", action="store_true", help="write the files into a .knxprod archive instead of separate files")
+	parser.add_argument("--canonical", action="store_true", help="write reproducible, compact files, each with its SHA-1 in a .sha1 file next to it")
+	parser.add_argument("--product-procedure", action="store_true", help="declare an explicit load procedure instead of the default one of the mask (not verified against ETS)")
+	parser.add_argument("-f", "--force", action="store_true", help="regenerate every file, even if its inputs did not change")
+	parser.add_argument("-j", "--jobs", type=int, default=1, help="number of devices to generate in parallel (default: 1)")
+	parser.add_argument("--profile", metavar="FILE", help="write the time spent per generation stage to FILE as JSON")
+	parser.add_argument("-w", "--watch", action="store_true", help="keep running and regenerate the devices whose sources change")
+	args = parser.parse_args(argv)
+
+	sharedDatapointIndex = knxmaster.DatapointIndex(args.master)
+
+	srcPaths = findSources(args.sources, args.master)
+
+	batch = len(srcPaths) > 1 or any(os.path.isdir(path) for path in args.sources)
+
+	options = {"manufacturerId": args.manufacturer, "stream": args.stream, "compact": args.compact, "force": args.force, "package": args.package, "canonical": args.canonical, "productProcedure": args.product_procedure}
+	jobs = []
+
+	for srcPath in srcPaths:
+		jobs.append((srcPath, deviceOutputDir(srcPath, args.output, batch), options, args.profile is not None))
+
+	if batch or args.jobs > 1 or args.watch:
+		# Shared by all devices, so keep it out of the first device's timing
+		# and have it ready before any worker is forked
+		sharedDatapointIndex.load()
+
+	startTime = time.time()
+
+	if args.jobs > 1 and len(jobs) > 1:
+		pool = multiprocessing.Pool(min(args.jobs, len(jobs)), initWorker, (args.master,))
+		try:
+			results = pool.map(runDevice, jobs, 1)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		results = [runDevice(job) for job in jobs]
+
+	totalSeconds = time.time() - startTime
 
-indent(catalogXML)
-#ET.dump(catalogXML)
-catalogTree = ET.ElementTree(catalogXML)
-catalogTree.write("Catalog.xml", "utf-8", True)
+	failed = reportResults(results, totalSeconds, batch or args.watch)
 
-hardwareXML = createHardware(root)
+	if args.profile is not None:
+		writeProfile(args.profile, results, totalSeconds)
 
-indent(hardwareXML)
-#ET.dump(hardwareXML)
-hardwareTree = ET.ElementTree(hardwareXML)
-hardwareTree.write("Hardware.xml", "utf-8", True)
+	if args.watch:
+		# --force only applies to the first run, after that the build cache decides what a change affects
+		options = dict(options, force=False)
+		watchSources(args.sources, args.master, args.output, batch, options)
+		return 0
 
-productXML = createProduct(root)
+	return 1 if failed else 0
 
-indent(productXML)
-#ET.dump(productXML)
-productTree = ET.ElementTree(productXML)
-productTree.write(applicationProgramId + ".xml", "utf-8", True)
+if __name__ == '__main__':
+	sys.exit(main())
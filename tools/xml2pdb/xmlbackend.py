@@ -0,0 +1,22 @@
+#
+# xmlbackend.py - The XML libraries xml2pdb parses and builds trees with
+#
+# ET is the C accelerated cElementTree where it exists. It builds the same
+# trees as the pure Python ElementTree, several times faster, so everything
+# written from them stays byte for byte the same.
+#
+# lxml is optional. When it is installed, knx_master.xml is read with it
+# (see knxmaster.py). It is not used for the generated trees: its elements
+# keep attributes in insertion order, reject the literal xmlns:* attributes
+# of the KNX root and serialize empty elements as <a/>, so its serializer
+# could not reproduce the ElementTree output.
+#
+try:
+	import xml.etree.cElementTree as ET
+except ImportError:
+	import xml.etree.ElementTree as ET
+
+try:
+	from lxml import etree as lxml
+except ImportError:
+	lxml = None
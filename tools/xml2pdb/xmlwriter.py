@@ -0,0 +1,171 @@
+#
+# xmlwriter.py - Incremental, pretty-printing XML writer
+#
+# Produces the same bytes as indent() followed by ElementTree.write(), but
+# indents while serializing and lets a document be written piece by piece:
+# open elements are tracked on a stack and complete subtrees can be written
+# and dropped one at a time. Like indent(), it only replaces text and tails
+# that are whitespace, mixed content is written as it is.
+#
+
+def escapeText(text):
+	if "&" in text:
+		text = text.replace("&", "&amp;")
+	if "<" in text:
+		text = text.replace("<", "&lt;")
+	if ">" in text:
+		text = text.replace(">", "&gt;")
+	return text
+
+
+def escapeAttrib(text):
+	if "&" in text:
+		text = text.replace("&", "&amp;")
+	if "<" in text:
+		text = text.replace("<", "&lt;")
+	if ">" in text:
+		text = text.replace(">", "&gt;")
+	if "\"" in text:
+		text = text.replace("\"", "&quot;")
+	if "\n" in text:
+		text = text.replace("\n", "&#10;")
+	return text
+
+
+class XMLWriter(object):
+	"""Writes XML to a binary file object, indenting each level by indent.
+
+	Modelled on xml.sax.saxutils.XMLGenerator: startElement() and
+	endElement() open and close elements, writeElement() writes a whole
+	ElementTree subtree at the current position. With indent set to None no
+	whitespace is written at all.
+	"""
+
+	bufferSize = 4096
+
+	def __init__(self, out, encoding="utf-8", indent="  "):
+		self.out = out
+		self.encoding = encoding
+		self.indent = indent
+		self.stack = []
+		self.buffer = []
+		# True while the start tag of the innermost element is still open
+		self.pending = False
+		# True after text, which takes the place of the next indentation
+		self.inline = False
+		self.elementCount = 0
+
+	def write(self, text):
+		self.buffer.append(text)
+
+		if len(self.buffer) >= self.bufferSize:
+			self.flush()
+
+	def flush(self):
+		self.out.write(u"".join(self.buffer).encode(self.encoding, "xmlcharrefreplace"))
+		del self.buffer[:]
+
+	def newline(self, level):
+		if self.indent is not None:
+			self.write(u"\n" + level * self.indent)
+
+	def startDocument(self):
+		self.write(u"<?xml version='1.0' encoding='%s'?>\n" % self.encoding)
+
+	def endDocument(self):
+		if self.indent is not None:
+			self.write(u"\n")
+
+		self.flush()
+
+	def startElement(self, name, attrs):
+		if self.pending:
+			self.write(u">")
+
+		if self.stack and not self.inline:
+			self.newline(len(self.stack))
+
+		self.inline = False
+		self.write(u"<" + name)
+
+		for key, value in sorted(attrs.items()):
+			self.write(u" %s=\"%s\"" % (key, escapeAttrib(value)))
+
+		self.stack.append(name)
+		self.pending = True
+		self.elementCount += 1
+
+	def endElement(self, name=None):
+		tag = self.stack.pop()
+
+		if name is not None and name != tag:
+			raise ValueError("Closing <%s> while <%s> is open" % (name, tag))
+
+		if self.pending:
+			self.write(u" />")
+			self.pending = False
+		else:
+			if not self.inline:
+				self.newline(len(self.stack))
+
+			self.write(u"</" + tag + u">")
+
+		self.inline = False
+
+	def writeText(self, text):
+		"""Write the text or tail of an element that is not a leaf.
+
+		When indenting, whitespace is replaced by the indentation, as
+		indent() does.
+		"""
+		if not text or (self.indent is not None and not text.strip()):
+			return
+
+		if self.pending:
+			self.write(u">")
+			self.pending = False
+
+		self.write(escapeText(text))
+		self.inline = True
+
+	def writeLeaf(self, elem):
+		text = elem.text
+
+		if text:
+			self.write(u">" + escapeText(text) + u"</" + self.stack.pop() + u">")
+			self.pending = False
+		else:
+			self.endElement()
+
+	def writeElement(self, elem):
+		self.startElement(elem.tag, elem.attrib)
+
+		if not len(elem):
+			self.writeLeaf(elem)
+			self.writeText(elem.tail)
+			return
+
+		self.writeText(elem.text)
+
+		# Iterative walk, deep Dynamic trees must not hit the recursion limit
+		parents = [elem]
+		children = [iter(elem)]
+
+		while children:
+			child = next(children[-1], None)
+
+			if child is None:
+				children.pop()
+				self.endElement()
+				self.writeText(parents.pop().tail)
+				continue
+
+			self.startElement(child.tag, child.attrib)
+
+			if len(child):
+				self.writeText(child.text)
+				parents.append(child)
+				children.append(iter(child))
+			else:
+				self.writeLeaf(child)
+				self.writeText(child.tail)